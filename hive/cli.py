@@ -12,8 +12,9 @@ def run():
     """Run the service specified in the `--mode` argument."""
 
     conf = Conf.init_argparse()
-    Db.set_shared_instance(conf.db())
     mode = conf.mode()
+    if mode != 'dump-checkpoints':
+        Db.set_shared_instance(conf.db())
 
     if conf.get('test_profile'):
         from hive.utils.profiler import Profiler
@@ -37,6 +38,13 @@ def launch_mode(mode, conf):
         from hive.db.db_state import DbState
         print(DbState.status())
 
+    elif mode == 'dump-checkpoints':
+        from hive.indexer.checkpoints import dump_checkpoints
+        steem = conf.steem()
+        last_block = conf.get('test_max_block') or steem.last_irreversible()
+        dump_checkpoints(steem, conf.get('checkpoint_span'), last_block,
+                         prefetch=conf.get('sync_prefetch') or 1)
+
     else:
         raise Exception("unknown run mode %s" % mode)
 
@@ -27,7 +27,7 @@ class Conf():
             **kwargs)
         add = parser.add
 
-        # runmodes: sync, server, status
+        # runmodes: sync, server, status, dump-checkpoints
         add('mode', nargs='*', default=['sync'])
 
         # common
@@ -42,6 +42,10 @@ class Conf():
         add('--max-workers', type=int, env_var='MAX_WORKERS', help='max workers for batch requests', default=4)
         add('--max-batch', type=int, env_var='MAX_BATCH', help='max chunk size for batch requests', default=50)
         add('--trail-blocks', type=int, env_var='TRAIL_BLOCKS', help='number of blocks to trail head by', default=2)
+        add('--checkpoint-workers', type=int, env_var='CHECKPOINT_WORKERS', help='processes for decoding checkpoint files (0 to decode inline)', default=0)
+        add('--checkpoint-span', type=int, env_var='CHECKPOINT_SPAN', help='blocks per file written by dump-checkpoints', default=1000000)
+        add('--sync-prefetch', type=int, env_var='SYNC_PREFETCH', help='number of block chunks to prefetch during fast sync (0 to disable)', default=2)
+        add('--listen-prefetch', type=int, env_var='LISTEN_PREFETCH', help='number of blocks to prefetch in live mode (0 to disable)', default=2)
         add('--sync-to-s3', type=strtobool, env_var='SYNC_TO_S3', help='alternative healthcheck for background sync service', default=False)
 
         # test/debug
@@ -111,6 +115,7 @@ class Conf():
         - `server`: API server
         - `sync`: db sync process
         - `status`: status info dump
+        - `dump-checkpoints`: archive blocks to ./checkpoints
         """
         return '/'.join(self.get('mode'))
 
@@ -1,5 +1,6 @@
 """Wrapper for sqlalchemy, providing a simple interface."""
 
+import io
 import logging
 from time import perf_counter as perf
 from collections import OrderedDict
@@ -8,10 +9,23 @@ import sqlalchemy
 
 from hive.utils.stats import Stats
 
+# pylint: disable=too-many-lines
+
 logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
 
 log = logging.getLogger(__name__)
 
+def _copy_value(value):
+    """Format a value for PostgreSQL `COPY ... FROM` text format."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return (str(value).replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
 class Db:
     """RDBMS adapter for hive. Handles connecting and querying."""
 
@@ -83,6 +97,31 @@ class Db:
         res = self._query(sql, **kwargs)
         return res.fetchall()
 
+    def query_stream(self, sql, **kwargs):
+        """Perform a `SELECT n*m`, iterating rows as they are fetched.
+
+        Uses a server-side cursor, so large results are never held
+        in memory all at once. Server-side cursors only live within a
+        transaction; if none is active, one is held open until the
+        rows have been consumed. Postgres only.
+        """
+        trx = not self._trx_active
+        if trx:
+            self.query("START TRANSACTION")
+        try:
+            start = perf()
+            query = self._sql_text(sql).execution_options(stream_results=True)
+            result = self._exec(query, **kwargs)
+            Stats.log_db(sql, perf() - start)
+            yield from result
+        except Exception as e:
+            log.warning("[SQL-ERR] %s in query %s (%s)",
+                        e.__class__.__name__, sql, kwargs)
+            raise e
+        finally:
+            if trx:
+                self.query("COMMIT")
+
     def query_row(self, sql, **kwargs):
         """Perform a `SELECT 1*m`"""
         res = self._query(sql, **kwargs)
@@ -118,6 +157,27 @@ class Db:
         if trx:
             self.query("COMMIT")
 
+    def copy_rows(self, table, cols, rows):
+        """Bulk-load `rows` (sequences ordered as `cols`) using `COPY`.
+
+        Runs on the same connection, and thus inside any transaction
+        which is currently active. Postgres only.
+        """
+        buf = io.StringIO()
+        for row in rows:
+            buf.write('\t'.join(map(_copy_value, row)) + '\n')
+        buf.seek(0)
+
+        sql = "COPY %s (%s) FROM STDIN" % (table, ', '.join(cols))
+        try:
+            start = perf()
+            cursor = self._conn.connection.cursor()
+            cursor.copy_expert(sql, buf)
+            Stats.log_db(sql, perf() - start)
+        except Exception as e:
+            log.warning("[SQL-ERR] %s in %s", e.__class__.__name__, sql)
+            raise e
+
     @staticmethod
     def build_insert(table, values, pk=None):
         """Generates an INSERT statement w/ bindings."""
@@ -153,12 +213,58 @@ class Db:
 
         return (sql, values)
 
+    @staticmethod
+    def _bulk_values(rows):
+        """Build per-row bind lists for rows of equal columns."""
+        fields = [k for k, _ in OrderedDict(rows[0]).items()]
+        binds, params = [], {}
+        for idx, row in enumerate(rows):
+            row = OrderedDict(row)
+            assert list(row.keys()) == fields, "column mismatch in bulk rows"
+            binds.append(', '.join(':%s_%d' % (k, idx) for k in fields))
+            params.update(('%s_%d' % (k, idx), v) for k, v in row.items())
+        return fields, binds, params
+
+    @staticmethod
+    def build_bulk_insert(table, rows):
+        """Generates a multi-row INSERT statement w/ bindings.
+
+        All `rows` must have the same columns, in the same order."""
+        fields, binds, params = Db._bulk_values(rows)
+        values = ', '.join('(%s)' % bind for bind in binds)
+        sql = "INSERT INTO %s (%s) VALUES %s" % (table, ', '.join(fields), values)
+        return (sql, params)
+
+    @staticmethod
+    def build_bulk_update(table, rows, pk):
+        """Generates one `UPDATE ... FROM (VALUES ...)` w/ bindings.
+
+        All `rows` must have the same columns, in the same order. Each
+        row is unioned onto an empty select of `table`, so that untyped
+        literals (e.g. timestamp strings, NULLs) take the types of their
+        target columns (a multi-row `VALUES` would type them as text).
+        """
+        assert pk and isinstance(pk, (str, list))
+        pks = [pk] if isinstance(pk, str) else pk
+        fields, binds, params = Db._bulk_values(rows)
+
+        update = ', '.join([k+" = v."+k for k in fields if k not in pks])
+        where = ' AND '.join([table+"."+k+" = v."+k for k in pks])
+        values = ''.join("\n UNION ALL SELECT " + bind for bind in binds)
+        sql = """UPDATE %s SET %s
+                   FROM (SELECT %s FROM %s WHERE false%s) v
+                  WHERE %s"""
+        sql = sql % (table, update, ', '.join(fields), table, values, where)
+        return (sql, params)
+
     def _sql_text(self, sql):
         if sql in self._prep_sql:
             query = self._prep_sql[sql]
         else:
             query = sqlalchemy.text(sql).execution_options(autocommit=False)
-            self._prep_sql[sql] = query
+            # bulk statements rarely repeat; don't hold on to them
+            if len(sql) < 4096:
+                self._prep_sql[sql] = query
         return query
 
     def _query(self, sql, **kwargs):
@@ -166,7 +272,7 @@ class Db:
         if sql == 'START TRANSACTION':
             assert not self._trx_active
             self._trx_active = True
-        elif sql == 'COMMIT':
+        elif sql in ('COMMIT', 'ROLLBACK'):
             assert self._trx_active
             self._trx_active = False
 
@@ -188,6 +294,6 @@ class Db:
         if action == 'SELECT':
             return False
         if action in ['DELETE', 'UPDATE', 'INSERT', 'COMMIT', 'START',
-                      'ALTER', 'TRUNCA', 'CREATE', 'DROP I', 'DROP T']:
+                      'ROLLBA', 'ALTER', 'TRUNCA', 'CREATE', 'DROP I', 'DROP T']:
             return True
         raise Exception("unknown action: {}".format(sql))
@@ -0,0 +1,124 @@
+"""Buffered COPY-based writer for initial sync."""
+
+import logging
+from collections import OrderedDict
+
+from hive.db.adapter import Db
+
+log = logging.getLogger(__name__)
+
+class BulkLoader:
+    """Buffers inserted rows per table; writes them with `COPY`.
+
+    During initial sync, `Blocks.process_multi` activates the loader
+    for the duration of a chunk. Indexers add rows here instead of
+    issuing single-row `INSERT`s, and the buffers are flushed at the
+    chunk boundary, inside the chunk's transaction.
+
+    Rows may be keyed so that indexers can read back (or amend) rows
+    which have not been written yet. Tables with a serial `id` column
+    get ids allocated in memory via `next_id`, so callers can rely on
+    them immediately; the sequence is advanced on flush.
+    """
+
+    # columns written per table. order matters: tables are flushed
+    # in this order so that foreign keys are satisfied.
+    TABLES = OrderedDict([
+        ('hive_blocks', ('num', 'hash', 'prev', 'txs', 'ops', 'created_at')),
+        ('hive_accounts', ('id', 'name', 'created_at')),
+        ('hive_posts', ('id', 'parent_id', 'author', 'permlink', 'category',
+                        'community_id', 'created_at', 'depth', 'is_deleted',
+                        'is_muted', 'is_valid', 'promoted')),
+        ('hive_payments', ('block_num', 'tx_idx', 'post_id', 'from_account',
+                           'to_account', 'amount', 'token')),
+    ])
+
+    _db = None
+    _active = False
+
+    # table -> {key: row}
+    _rows = {table: OrderedDict() for table in TABLES}
+
+    # table -> next id to allocate
+    _next_ids = {}
+
+    @classmethod
+    def db(cls):
+        """Get a db adapter instance."""
+        if not cls._db:
+            cls._db = Db.instance()
+        return cls._db
+
+    @classmethod
+    def begin(cls):
+        """Start buffering writes."""
+        assert not cls._active, "bulk loader already active"
+        cls._active = True
+
+    @classmethod
+    def finish(cls):
+        """Flush all buffers and stop buffering writes."""
+        assert cls._active, "bulk loader not active"
+        count = cls.flush()
+        cls.reset()
+        return count
+
+    @classmethod
+    def reset(cls):
+        """Stop buffering writes, discarding any unflushed rows.
+
+        Allocated ids are forgotten as well, so that they are read
+        back from the db on the next `begin`."""
+        cls._active = False
+        cls._rows = {table: OrderedDict() for table in cls.TABLES}
+        cls._next_ids = {}
+
+    @classmethod
+    def is_active(cls):
+        """Check if writes should be routed through the loader."""
+        return cls._active
+
+    @classmethod
+    def add(cls, table, row, key=None):
+        """Buffer a row (dict of column values) for `table`."""
+        assert cls._active, "bulk loader not active"
+        rows = cls._rows[table]
+        if key is None:
+            key = len(rows)
+        assert key not in rows, "duplicate key %s in %s" % (key, table)
+        rows[key] = row
+
+    @classmethod
+    def pending(cls, table, key):
+        """Get a buffered (mutable) row by key, or None."""
+        return cls._rows[table].get(key)
+
+    @classmethod
+    def next_id(cls, table):
+        """Allocate the next serial id for `table`."""
+        if table not in cls._next_ids:
+            sql = "SELECT COALESCE(MAX(id), 0) + 1 FROM %s" % table
+            cls._next_ids[table] = cls.db().query_one(sql)
+        _id = cls._next_ids[table]
+        cls._next_ids[table] += 1
+        return _id
+
+    @classmethod
+    def flush(cls):
+        """Write all buffered rows. Returns number of rows written."""
+        count = 0
+        for table, cols in cls.TABLES.items():
+            rows = cls._rows[table]
+            if not rows:
+                continue
+            cls.db().copy_rows(table, cols, ([row[col] for col in cols]
+                                             for row in rows.values()))
+            count += len(rows)
+            cls._rows[table] = OrderedDict()
+
+            if 'id' in cols:
+                # ids were allocated by us; catch the sequence up
+                sql = """SELECT setval(pg_get_serial_sequence('%s', 'id'),
+                                       (SELECT MAX(id) FROM %s))"""
+                cls.db().query_one(sql % (table, table))
+        return count
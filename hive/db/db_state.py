@@ -6,7 +6,8 @@ import time
 import logging
 
 from hive.db.schema import (setup, reset_autovac, build_metadata,
-                            build_metadata_community, teardown, DB_VERSION)
+                            build_metadata_community, teardown, undo_schema,
+                            DB_VERSION)
 from hive.db.adapter import Db
 
 log = logging.getLogger(__name__)
@@ -148,7 +149,7 @@ class DbState:
         """Routine which runs *once* after initial sync.
 
         Re-creates non-core indexes for serving APIs after init sync,
-        as well as all foreign keys."""
+        as well as all foreign keys; and creates block undo triggers."""
 
         engine = cls.db().engine()
         log.info("[INIT] Begin post-initial sync hooks")
@@ -162,8 +163,19 @@ class DbState:
         #    log.info("Create fk %s", key.name)
         #    key.create(engine)
 
+        log.info("Create block undo triggers")
+        cls._create_undo_triggers()
+
         log.info("[INIT] Finish post-initial sync hooks")
 
+    @classmethod
+    def _create_undo_triggers(cls):
+        """Create undo journal triggers on all existing journaled tables."""
+        sql = "SELECT tablename FROM pg_catalog.pg_tables WHERE schemaname = 'public'"
+        tables = set(cls.db().query_col(sql))
+        for sql in undo_schema(tables):
+            cls.db().query(sql)
+
     @staticmethod
     def status():
         """Basic health status: head block/time, current age (secs)."""
@@ -311,6 +323,13 @@ class DbState:
             cls.db().query("CREATE INDEX hive_notifs_ix6 ON hive_notifs (dst_id, created_at, score, id) WHERE dst_id IS NOT NULL")
             cls._set_ver(16)
 
+        if cls._ver == 16:
+            build_metadata().tables['hive_undo'].create(cls.db().engine())
+            if not cls._is_feed_cache_empty():
+                # otherwise, created once initial sync completes
+                cls._create_undo_triggers()
+            cls._set_ver(17)
+
         reset_autovac(cls.db())
 
         log.info("[HIVE] db version: %d", cls._ver)
@@ -7,10 +7,11 @@ from sqlalchemy.types import CHAR
 from sqlalchemy.types import VARCHAR
 from sqlalchemy.types import TEXT
 from sqlalchemy.types import BOOLEAN
+from sqlalchemy.dialects.postgresql import JSONB
 
 #pylint: disable=line-too-long, too-many-lines, bad-whitespace
 
-DB_VERSION = 16
+DB_VERSION = 17
 
 def build_metadata():
     """Build schema def with SqlAlchemy"""
@@ -237,6 +238,18 @@ def build_metadata():
         sa.Column('dgpo', sa.Text, nullable=False),
     )
 
+    sa.Table(
+        'hive_undo', metadata,
+        sa.Column('id', sa.BigInteger, primary_key=True),
+        sa.Column('block_num', sa.Integer, nullable=False),
+        sa.Column('table_name', VARCHAR(32), nullable=False),
+        sa.Column('op', CHAR(1), nullable=False), # (I)nsert, (U)pdate, (D)elete
+        sa.Column('key', JSONB, nullable=False),
+        sa.Column('data', JSONB),
+
+        sa.Index('hive_undo_ix1', 'block_num', 'id'),
+    )
+
     metadata = build_metadata_community(metadata)
 
     return metadata
@@ -448,3 +461,85 @@ def native_ads_schema():
     )
 
     return _sql
+
+# tables journaled for block undo, and the columns identifying a row
+UNDO_TABLES = {
+    'hive_blocks':        ['num'],
+    'hive_accounts':      ['id'],
+    'hive_posts':         ['id'],
+    'hive_post_tags':     ['post_id', 'tag'],
+    'hive_follows':       ['following', 'follower'],
+    'hive_reblogs':       ['account', 'post_id'],
+    'hive_payments':      ['id'],
+    'hive_feed_cache':    ['post_id', 'account_id'],
+    'hive_posts_cache':   ['post_id'], # vote/payout state; not derivable from hive_posts
+    'hive_communities':   ['id'],
+    'hive_roles':         ['account_id', 'community_id'],
+    'hive_subscriptions': ['account_id', 'community_id'],
+    'hive_notifs':        ['id'],
+    'hive_ads':           ['post_id'],
+    'hive_ads_state':     ['post_id', 'community_id'],
+    'hive_ads_settings':  ['community_id'],
+}
+
+def undo_schema(tables=None):
+    """Populate sql statements to create the block undo journal triggers.
+
+    Row changes to `UNDO_TABLES` are logged to `hive_undo` while the
+    `hive.block_num` setting is set (see `Blocks.process`): the key of
+    inserted rows, the prior values of updated columns, and the whole
+    of deleted rows. If `tables` is given, triggers are only created
+    for the `UNDO_TABLES` found in it.
+
+    Triggers fire for every row written, so they are only created once
+    initial sync is complete (see `DbState`).
+    """
+    _sql = ["""
+        CREATE OR REPLACE FUNCTION hive_undo_log() RETURNS trigger AS $$
+        DECLARE
+            num integer := NULLIF(current_setting('hive.block_num', true), '')::integer;
+            new_row jsonb;
+            old_row jsonb;
+            diff jsonb;
+        BEGIN
+            IF num IS NULL THEN
+                RETURN NULL;
+            END IF;
+
+            IF TG_OP = 'INSERT' THEN
+                new_row := to_jsonb(NEW);
+                INSERT INTO hive_undo (block_num, table_name, op, key)
+                     SELECT num, TG_TABLE_NAME, 'I', jsonb_object_agg(k, new_row -> k)
+                       FROM unnest(TG_ARGV) k;
+            ELSIF TG_OP = 'UPDATE' THEN
+                new_row := to_jsonb(NEW);
+                old_row := to_jsonb(OLD);
+                SELECT jsonb_object_agg(o.key, o.value) INTO diff
+                  FROM jsonb_each(old_row) o
+                 WHERE new_row -> o.key IS DISTINCT FROM o.value;
+                IF diff IS NOT NULL THEN
+                    INSERT INTO hive_undo (block_num, table_name, op, key, data)
+                         SELECT num, TG_TABLE_NAME, 'U', jsonb_object_agg(k, new_row -> k), diff
+                           FROM unnest(TG_ARGV) k;
+                END IF;
+            ELSE
+                old_row := to_jsonb(OLD);
+                INSERT INTO hive_undo (block_num, table_name, op, key, data)
+                     SELECT num, TG_TABLE_NAME, 'D', jsonb_object_agg(k, old_row -> k), old_row
+                       FROM unnest(TG_ARGV) k;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """]
+
+    for table, keys in UNDO_TABLES.items():
+        if tables is not None and table not in tables:
+            continue
+        _sql.append("DROP TRIGGER IF EXISTS hive_undo_trigger ON %s" % table)
+        _sql.append("""CREATE TRIGGER hive_undo_trigger
+                        AFTER INSERT OR UPDATE OR DELETE ON %s
+                        FOR EACH ROW EXECUTE PROCEDURE hive_undo_log(%s)"""
+                    % (table, ', '.join("'%s'" % key for key in keys)))
+
+    return _sql
@@ -8,46 +8,71 @@ from toolz import partition_all
 import ujson as json
 
 from hive.db.adapter import Db
+from hive.db.bulk_loader import BulkLoader
 from hive.utils.normalize import rep_log10, vests_amount
 from hive.utils.timer import Timer
 from hive.utils.account import safe_profile_metadata
 from hive.utils.unique_fifo import UniqueFIFO
+from hive.utils.name_map import NameMap
+from hive.utils.rank_index import RankIndex
+from hive.utils.fingerprints import Fingerprints
+
+# pylint: disable=too-many-lines
 
 log = logging.getLogger(__name__)
 
 DB = Db.instance()
 
+# column groups fingerprinted to skip unchanged writes
+PROFILE_COLUMNS = ['display_name', 'about', 'location', 'website',
+                   'profile_image', 'cover_image']
+STATS_COLUMNS = ['reputation', 'post_count', 'active_at']
+GROUPS = ['row', 'stats', 'profile', 'raw_json']
+
 class Accounts:
     """Manages account id map, dirty queue, and `hive_accounts` table."""
 
     # name->id map
-    _ids = {}
+    _ids = NameMap()
 
-    # fifo queue
+    # fifo queue of accounts needing a full refresh
     _dirty = UniqueFIFO()
 
-    # in-mem id->rank map
-    _ranks = {}
+    # fifo queue of accounts needing only a stats (lite) refresh
+    _dirty_lite = UniqueFIFO()
+
+    # in-mem account ranks by vote_weight
+    _ranks = RankIndex()
+
+    # fingerprints of last-written column groups, by account id
+    _fingerprints = Fingerprints(1000000)
 
     # account core methods
     # --------------------
 
     @classmethod
     def load_ids(cls):
-        """Load a full (name: id) dict into memory."""
+        """Load a full (name: id) map into memory."""
         assert not cls._ids, "id map already loaded"
-        cls._ids = dict(DB.query_all("SELECT name, id FROM hive_accounts"))
+        sql = 'SELECT name, id FROM hive_accounts ORDER BY name COLLATE "C"'
+        cls._ids = NameMap.from_sorted(DB.query_stream(sql))
+        log.info("loaded %d account ids (%dmb)",
+                 len(cls._ids), cls._ids.nbytes() // 1024**2)
 
     @classmethod
     def clear_ids(cls):
         """Wipe id map. Only used for db migration #5."""
         cls._ids = None
 
+    @classmethod
+    def clear_cache(cls):
+        """Drop column fingerprints, e.g. after rows are rewound."""
+        cls._fingerprints.clear()
+
     @classmethod
     def default_score(cls, name):
         """Return default notification score based on rank."""
-        _id = cls.get_id(name)
-        rank = cls._ranks[_id] if _id in cls._ranks else 1000000
+        rank = cls._rank(cls.get_id(name)) or 1000000
         if rank < 200: return 70    # 0.02% 100k
         if rank < 1000: return 60   # 0.1%  10k
         if rank < 6500: return 50   # 0.5%  1k
@@ -74,6 +99,10 @@ class Accounts:
         *account_create*, *account_create_with_delegation*, *pow*,
         and *pow2*. *pow* ops result in account creation only when
         the account they name does not already exist!
+
+        During initial sync, rows are handed to `BulkLoader` (with ids
+        allocated up front) and written once per chunk. Otherwise all
+        new names are inserted with a single statement.
         """
 
         # filter out names which already registered
@@ -81,14 +110,24 @@ class Accounts:
         if not new_names:
             return
 
-        for name in new_names:
-            DB.query("INSERT INTO hive_accounts (name, created_at) "
-                     "VALUES (:name, :date)", name=name, date=block_date)
-
-        # pull newly-inserted ids and merge into our map
-        sql = "SELECT name, id FROM hive_accounts WHERE name IN :names"
-        for name, _id in DB.query_all(sql, names=tuple(new_names)):
-            cls._ids[name] = _id
+        if BulkLoader.is_active():
+            for name in new_names:
+                _id = BulkLoader.next_id('hive_accounts')
+                BulkLoader.add('hive_accounts', {
+                    'id': _id,
+                    'name': name,
+                    'created_at': block_date}, key=name)
+                cls._ids[name] = _id
+        else:
+            sql = """INSERT INTO hive_accounts (name, created_at)
+                          VALUES %s RETURNING name, id"""
+            for batch in partition_all(1000, new_names):
+                params = {'name_%d' % idx: name for idx, name in enumerate(batch)}
+                values = ["(:%s, :date)" % key for key in params]
+                # merge newly-inserted ids into our map
+                for name, _id in DB.query(sql % ', '.join(values),
+                                          date=block_date, **params):
+                    cls._ids[name] = _id
 
         # post-insert: pass to communities to check for new registrations
         from hive.indexer.community import Community, START_DATE
@@ -103,6 +142,17 @@ class Accounts:
         """Marks given account as needing an update."""
         return cls._dirty.add(account)
 
+    @classmethod
+    def dirty_lite(cls, account):
+        """Marks given account as needing a stats-only update.
+
+        Used for post and vote activity, which changes reputation,
+        post_count and active_at but not the account's metadata.
+        """
+        if account in cls._dirty:
+            return 0
+        return cls._dirty_lite.add(account)
+
     @classmethod
     def dirty_set(cls, accounts):
         """Marks given accounts as needing an update."""
@@ -111,7 +161,7 @@ class Accounts:
     @classmethod
     def dirty_all(cls):
         """Marks all accounts as dirty. Use to rebuild entire table."""
-        cls.dirty(set(DB.query_col("SELECT name FROM hive_accounts")))
+        cls.dirty_set(set(DB.query_col("SELECT name FROM hive_accounts")))
 
     @classmethod
     def dirty_oldest(cls, limit=50000):
@@ -128,41 +178,120 @@ class Accounts:
         """
         accounts = cls._dirty.shift_portion(spread)
 
-        count = len(accounts)
+        # lite updates are redundant for accounts pending a full one
+        full = set(accounts)
+        lite = [name for name in cls._dirty_lite.shift_portion(spread)
+                if name not in full and name not in cls._dirty]
+
+        count = len(accounts) + len(lite)
         if not count:
             return 0
 
         if trx:
-            log.info("[SYNC] update %d accounts", count)
+            log.info("[SYNC] update %d accounts (%d lite)", count, len(lite))
 
-        cls._cache_accounts(accounts, steem, trx=trx)
+        if accounts:
+            cls._cache_accounts(accounts, steem, trx=trx)
+        if lite:
+            cls._cache_accounts(lite, steem, trx=trx, lite=True)
         return count
 
     @classmethod
     def fetch_ranks(cls):
-        """Rebuild account ranks and store in memory for next update."""
-        sql = "SELECT id FROM hive_accounts ORDER BY vote_weight DESC"
-        for rank, _id in enumerate(DB.query_col(sql)):
-            cls._ranks[_id] = rank + 1
+        """Load account ranks into memory.
+
+        Only needed at startup; ranks are kept current by `_sql` as
+        each account's new vote_weight is written.
+        """
+        sql = "SELECT id, vote_weight FROM hive_accounts ORDER BY vote_weight, id"
+        cls._ranks = RankIndex.from_rows(DB.query_stream(sql))
+        log.info("loaded %d account ranks (%dmb)",
+                 len(cls._ranks), cls._ranks.nbytes() // 1024**2)
 
     @classmethod
-    def _cache_accounts(cls, accounts, steem, trx=True):
-        """Fetch all `accounts` and write to db."""
-        timer = Timer(len(accounts), 'account', ['rps', 'wps'])
-        for name_batch in partition_all(1000, accounts):
-            cached_at = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    def _rank(cls, _id):
+        """Get an account's current rank, or None."""
+        return cls._ranks.rank(_id)
 
+    @classmethod
+    def _cache_accounts(cls, accounts, steem, trx=True, lite=False):
+        """Fetch all `accounts` and write to db.
+
+        Batches are fetched in parallel over the steem client's worker
+        pool, ahead of this (writer) loop which drains them in order.
+        If `lite`, only stats columns are written (see `_sql_lite`).
+        """
+        timer = Timer(len(accounts), 'account', ['rps', 'wps'])
+        batches = steem.get_accounts_multi(partition_all(1000, accounts))
+        while True:
             timer.batch_start()
-            batch = steem.get_accounts(name_batch)
+            batch = next(batches, None)
+            if batch is None:
+                break
+            cached_at = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
 
             timer.batch_lap()
-            sqls = [cls._sql(acct, cached_at) for acct in batch]
+            if lite:
+                sqls = [sql for sql in map(cls._sql_lite, batch) if sql]
+            else:
+                sqls = [cls._sql(acct, cached_at) for acct in batch]
             DB.batch_queries(sqls, trx)
 
             timer.batch_finish(len(batch))
             if trx or len(accounts) > 1000:
                 log.info(timer.batch_status())
 
+    @classmethod
+    def _changed(cls, _id, values):
+        """Drop column groups unchanged since they were last written.
+
+        `name` (the key) and `cached_at` are always kept, the latter
+        since `dirty_oldest` relies on it to cycle through accounts.
+        """
+        keep = ('name', 'cached_at')
+        groups = {group: [] for group in GROUPS}
+        for col, val in values.items():
+            if col not in keep:
+                group = ('profile' if col in PROFILE_COLUMNS else
+                         'stats' if col in STATS_COLUMNS else
+                         'raw_json' if col == 'raw_json' else 'row')
+                groups[group].append((col, val))
+
+        out = {col: values[col] for col in keep if col in values}
+        for group, cols in groups.items():
+            if cols and cls._fingerprints.changed(_id, group, cols):
+                out.update(cols)
+        return out
+
+    @staticmethod
+    def _active_at(account):
+        """Most recent activity date of a steemd account."""
+        return max(account['created'],
+                   account['last_account_update'],
+                   account['last_post'],
+                   account['last_root_post'],
+                   account['last_vote_time'])
+
+    @classmethod
+    def _sql_lite(cls, account):
+        """Prepare a stats-only SQL query from a steemd account.
+
+        Returns None if the stats are unchanged since last written.
+        """
+        _id = cls.get_id(account['name'])
+        values = {
+            'name':       account['name'],
+            'reputation': rep_log10(account['reputation']),
+            'post_count': account['post_count'],
+            'active_at':  cls._active_at(account)}
+        if _id:
+            values = cls._changed(_id, values)
+            if len(values) == 1:
+                return None
+
+        bind = ', '.join([k+" = :"+k for k in list(values.keys())][1:])
+        return ("UPDATE hive_accounts SET %s WHERE name = :name" % bind, values)
+
     @classmethod
     def _sql(cls, account, cached_at):
         """Prepare a SQL query from a steemd account."""
@@ -187,11 +316,7 @@ class Accounts:
         profile = safe_profile_metadata(account)
         del account['json_metadata']
 
-        active_at = max(account['created'],
-                        account['last_account_update'],
-                        account['last_post'],
-                        account['last_root_post'],
-                        account['last_vote_time'])
+        active_at = cls._active_at(account)
 
         values = {
             'name':         account['name'],
@@ -215,8 +340,15 @@ class Accounts:
 
         # update rank field, if present
         _id = cls.get_id(account['name'])
-        if _id in cls._ranks:
-            values['rank'] = cls._ranks[_id]
+        if _id:
+            cls._ranks.set(_id, vote_weight)
+        rank = cls._rank(_id)
+        if rank:
+            values['rank'] = rank
+
+        # drop unchanged columns
+        if _id:
+            values = cls._changed(_id, values)
 
         bind = ', '.join([k+" = :"+k for k in list(values.keys())][1:])
         return ("UPDATE hive_accounts SET %s WHERE name = :name" % bind, values)
@@ -1,8 +1,10 @@
 """Blocks processor."""
 
 import logging
+import ujson as json
 
 from hive.db.adapter import Db
+from hive.db.bulk_loader import BulkLoader
 
 from hive.indexer.accounts import Accounts
 from hive.indexer.posts import Posts
@@ -10,6 +12,10 @@ from hive.indexer.cached_post import CachedPost
 from hive.indexer.custom_op import CustomOp
 from hive.indexer.payments import Payments
 from hive.indexer.follow import Follow
+from hive.indexer.notify import Notify
+from hive.indexer.community import Community
+
+# pylint: disable=too-many-lines
 
 log = logging.getLogger(__name__)
 
@@ -32,30 +38,70 @@ class Blocks:
 
     @classmethod
     def process(cls, block):
-        """Process a single block. Always wrap in a transaction!"""
+        """Process a single block. Always wrap in a transaction!
+
+        All changes made until the transaction commits are journaled in
+        `hive_undo` against this block, so that it can be undone if it
+        is forked out (see `_undo`).
+        """
         #assert is_trx_active(), "Block.process must be in a trx"
+        num = int(block['block_id'][:8], base=16)
+        DB.query_one("SELECT set_config('hive.block_num', :num, true)", num=str(num))
         return cls._process(block, is_initial_sync=False)
 
+    @classmethod
+    def prune_undo(cls, last_irreversible):
+        """Drop undo journal entries of irreversible blocks."""
+        DB.query("DELETE FROM hive_undo WHERE block_num <= :num",
+                 num=last_irreversible)
+
     @classmethod
     def process_multi(cls, blocks, is_initial_sync=False):
-        """Batch-process blocks; wrapped in a transaction."""
+        """Batch-process blocks; wrapped in a transaction.
+
+        During initial sync, inserts are buffered by `BulkLoader` and
+        written with `COPY` once the whole batch is processed; follow
+        states are likewise upserted once per batch.
+        """
         DB.query("START TRANSACTION")
+        if is_initial_sync:
+            BulkLoader.begin()
 
         last_num = 0
         try:
-            for block in blocks:
-                last_num = cls._process(block, is_initial_sync)
-        except Exception as e:
-            log.error("exception encountered block %d", last_num + 1)
-            raise e
-
-        # Follows flushing needs to be atomic because recounts are
-        # expensive. So is tracking follows at all; hence we track
-        # deltas in memory and update follow/er counts in bulk.
-        Follow.flush(trx=False)
+            try:
+                for block in blocks:
+                    last_num = cls._process(block, is_initial_sync)
+            except Exception as e:
+                log.error("exception encountered block %d", last_num + 1)
+                raise e
+
+            if is_initial_sync:
+                BulkLoader.finish()
+                Follow.flush_upserts()
+
+            # Follows flushing needs to be atomic because recounts are
+            # expensive. So is tracking follows at all; hence we track
+            # deltas in memory and update follow/er counts in bulk.
+            Follow.flush(trx=False)
+            Notify.flush()
+        except Exception:
+            cls._rollback()
+            raise
 
         DB.query("COMMIT")
 
+    @classmethod
+    def _rollback(cls):
+        """Roll back a failed batch, and drop in-memory state from it.
+
+        Allocated ids, cached states and pending writes may all refer
+        to rows which were never written."""
+        DB.query("ROLLBACK")
+        BulkLoader.reset()
+        Notify.clear()
+        cls._reset_caches()
+
     @classmethod
     def _process(cls, block, is_initial_sync=False):
         """Process a single block. Assumes a trx is open."""
@@ -94,13 +140,13 @@ class Blocks:
                 elif op_type == 'comment_operation':
                     Posts.comment_op(op, date)
                     if not is_initial_sync:
-                        Accounts.dirty(op['author']) # lite - stats
+                        Accounts.dirty_lite(op['author']) # stats
                 elif op_type == 'delete_comment_operation':
                     Posts.delete_op(op)
                 elif op_type == 'vote_operation':
                     if not is_initial_sync:
-                        Accounts.dirty(op['author']) # lite - rep
-                        Accounts.dirty(op['voter']) # lite - stats
+                        Accounts.dirty_lite(op['author']) # rep
+                        Accounts.dirty_lite(op['voter']) # stats
                         CachedPost.vote(op['author'], op['permlink'],
                                         None, op['voter'])
 
@@ -111,6 +157,7 @@ class Blocks:
                     json_ops.append(op)
 
         Accounts.register(account_names, date)     # register any new names
+        Posts.flush_inserts()                      # write any new posts
         CustomOp.process_ops(json_ops, num, date)  # follow/reblog/community ops
 
         return num
@@ -148,7 +195,79 @@ class Blocks:
         fork_limit = steem.last_irreversible()
         assert cursor < fork_limit, "not proceeding until head is irreversible"
 
-        cls._pop(to_pop)
+        if all(cls._has_undo(block['num']) for block in to_pop):
+            cls._undo([block['num'] for block in to_pop])
+            cls._reset_caches()
+            cls._replay(steem, cursor + 1, hive_head)
+        else:
+            cls._pop(to_pop)
+
+    @classmethod
+    def _has_undo(cls, num):
+        """Check if block `num` was journaled (i.e. can be undone)."""
+        sql = """SELECT 1 FROM hive_undo WHERE block_num = :num
+                    AND table_name = 'hive_blocks' AND op = 'I' LIMIT 1"""
+        return bool(DB.query_one(sql, num=num))
+
+    @classmethod
+    def _undo(cls, nums):
+        """Exactly undo head blocks `nums` (descending) from the journal.
+
+        Journaled row changes are reverted newest-first: inserts are
+        deleted, updated columns restored, and deleted rows re-inserted.
+        """
+        DB.query("START TRANSACTION")
+        for num in nums:
+            assert num == cls.head_num(), "can only undo head block"
+            log.warning("[FORK] undoing block %d", num)
+            sql = """SELECT table_name, op, key, data FROM hive_undo
+                      WHERE block_num = :num ORDER BY id DESC"""
+            for table, op, key, data in DB.query_all(sql, num=num):
+                DB.query(cls._undo_sql(table, op, key, data),
+                         key=json.dumps(key),
+                         data=json.dumps(data) if data else None)
+            DB.query("DELETE FROM hive_undo WHERE block_num = :num", num=num)
+        DB.query("COMMIT")
+        log.warning("[FORK] undo complete")
+
+    @staticmethod
+    def _undo_sql(table, op, key, data):
+        """Build the statement reverting one journaled row change."""
+        record = "jsonb_populate_record(NULL::%s, CAST(:%%s AS jsonb))" % table
+        match = ' AND '.join('%s.%s = k.%s' % (table, col, col) for col in key)
+        if op == 'I':
+            return "DELETE FROM %s USING %s k WHERE %s" % (
+                table, record % 'key', match)
+        if op == 'U':
+            cols = ', '.join('%s = d.%s' % (col, col) for col in data)
+            return "UPDATE %s SET %s FROM %s d, %s k WHERE %s" % (
+                table, cols, record % 'data', record % 'key', match)
+        assert op == 'D', "invalid undo op %s" % op
+        return "INSERT INTO %s SELECT * FROM %s" % (table, record % 'data')
+
+    @classmethod
+    def _reset_caches(cls):
+        """Drop in-memory state which may refer to rewound rows."""
+        Follow.clear_cache()
+        Posts.clear_ids()
+        CachedPost.clear_cache()
+        Accounts.clear_ids()
+        Accounts.clear_cache()
+        Accounts.load_ids()
+        Accounts.fetch_ranks()
+        Community.recalc_pending_payouts()
+
+    @classmethod
+    def _replay(cls, steem, lbound, ubound):
+        """Apply replacement blocks `lbound`..`ubound` after a rewind."""
+        for num in range(lbound, ubound + 1):
+            block = steem.get_block(num)
+            log.warning("[FORK] replaying block %d", num)
+            DB.query("START TRANSACTION")
+            cls.process(block)
+            Follow.flush(trx=False)
+            Notify.flush()
+            DB.query("COMMIT")
 
     @classmethod
     def _get(cls, num):
@@ -162,21 +281,26 @@ class Blocks:
         """Insert a row in `hive_blocks`."""
         num = int(block['block_id'][:8], base=16)
         txs = block['transactions']
-        DB.query("INSERT INTO hive_blocks (num, hash, prev, txs, ops, created_at) "
-                 "VALUES (:num, :hash, :prev, :txs, :ops, :date)", **{
-                     'num': num,
-                     'hash': block['block_id'],
-                     'prev': block['previous'],
-                     'txs': len(txs),
-                     'ops': sum([len(tx['operations']) for tx in txs]),
-                     'date': block['timestamp']})
+        row = {'num': num,
+               'hash': block['block_id'],
+               'prev': block['previous'],
+               'txs': len(txs),
+               'ops': sum([len(tx['operations']) for tx in txs]),
+               'created_at': block['timestamp']}
+        if BulkLoader.is_active():
+            BulkLoader.add('hive_blocks', row)
+        else:
+            DB.query("INSERT INTO hive_blocks (num, hash, prev, txs, ops, created_at) "
+                     "VALUES (:num, :hash, :prev, :txs, :ops, :created_at)", **row)
         return num
 
     @classmethod
     def _pop(cls, blocks):
         """Pop head blocks to navigate head to a point prior to fork.
 
-        Without an undo database, there is a limit to how fully we can recover.
+        Only used for blocks missing from the undo journal (see `_undo`),
+        e.g. those indexed before it existed. Without it, there is a limit
+        to how fully we can recover.
 
         If consistency is critical, run hive with TRAIL_BLOCKS=-1 to only index
         up to last irreversible. Otherwise use TRAIL_BLOCKS=2 to stay closer
@@ -210,12 +334,14 @@ class Blocks:
             DB.query("DELETE FROM hive_feed_cache  WHERE created_at >= :date", date=date)
             DB.query("DELETE FROM hive_reblogs     WHERE created_at >= :date", date=date)
             DB.query("DELETE FROM hive_follows     WHERE created_at >= :date", date=date) #*
+            Follow.clear_cache()
 
             # remove posts: core, tags, cache entries
             if post_ids:
                 DB.query("DELETE FROM hive_posts_cache WHERE post_id IN :ids", ids=post_ids)
                 DB.query("DELETE FROM hive_post_tags   WHERE post_id IN :ids", ids=post_ids)
                 DB.query("DELETE FROM hive_posts       WHERE id      IN :ids", ids=post_ids)
+                CachedPost.clear_cache()
 
             DB.query("DELETE FROM hive_payments    WHERE block_num = :num", num=num)
             DB.query("DELETE FROM hive_blocks      WHERE num = :num", num=num)
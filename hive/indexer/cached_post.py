@@ -10,9 +10,15 @@ from hive.db.adapter import Db
 
 from hive.utils.post import post_basic, post_legacy, post_payout, post_stats, mentions
 from hive.utils.timer import Timer
+from hive.utils.prefetch import Prefetch
+from hive.utils.level_queue import LevelQueue
+from hive.utils.payout_schedule import PayoutSchedule
+from hive.utils.fingerprints import Fingerprints
+from hive.utils.normalize import parse_time, utc_timestamp
 from hive.indexer.accounts import Accounts
 from hive.indexer.notify import Notify
 from hive.indexer.native_ads import NativeAd
+from hive.indexer.community import Community
 
 # pylint: disable=too-many-lines
 
@@ -23,8 +29,17 @@ DB = Db.instance()
 # levels of post dirtiness, in order of decreasing priority
 LEVELS = ['insert', 'payout', 'update', 'upvote', 'recount']
 
-def _keyify(items):
-    return dict(map(lambda x: ("val_%d" % x[0], x[1]), enumerate(items)))
+# column groups fingerprinted to skip unchanged writes; wide (TOASTed)
+# columns get their own groups, all other columns fall under `row`
+COLUMN_GROUPS = {'preview': 'body', 'body': 'body', 'img_url': 'body',
+                 'json': 'json', 'raw_json': 'raw_json'}
+GROUPS = ['row', 'body', 'json', 'raw_json']
+
+def _timestamp(date):
+    """Unix timestamp of a db datetime or chain date string."""
+    if isinstance(date, str):
+        date = parse_time(date[:19].replace(' ', 'T'))
+    return int(utc_timestamp(date))
 
 class CachedPost:
     """Maintain update queue and writing to `hive_posts_cache`."""
@@ -38,8 +53,8 @@ class CachedPost:
     # urls which are missing from id map
     _noids = set()
 
-    # dirty posts; {key: dirty_level}
-    _queue = collections.OrderedDict()
+    # dirty posts; url queued at index of its LEVEL
+    _queue = LevelQueue(len(LEVELS))
 
     # new promoted values, pending write
     _pending_promoted = {}
@@ -47,6 +62,18 @@ class CachedPost:
     # pending vote notifs {pid: [voters]}
     _votes = {}
 
+    # notif candidates of current batch [(notify, mute_key, seen_key)]
+    _notif_queue = []
+
+    # root post tags of current batch {pid: (tags, diff)}
+    _tag_queue = {}
+
+    # unpaid post ids by payout_at; loaded on first payout sweep
+    _payouts = None
+
+    # fingerprints of last-written column groups, by post id
+    _fingerprints = Fingerprints(2000000)
+
     @classmethod
     def update_promoted_amount(cls, post_id, amount):
         """Set a new pending amount for a post for its next update."""
@@ -59,12 +86,8 @@ class CachedPost:
         mode = LEVELS.index(level)
         url = author + '/' + permlink
 
-        # add to appropriate queue.
-        if url not in cls._queue:
-            cls._queue[url] = mode
-        # upgrade priority if needed
-        elif cls._queue[url] > mode:
-            cls._queue[url] = mode
+        # add to appropriate queue, or upgrade priority if needed
+        cls._queue.add(url, mode)
 
         # add to id map, or register missing
         if pid and url in cls._ids:
@@ -118,12 +141,13 @@ class CachedPost:
         """
         DB.query("DELETE FROM hive_posts_cache WHERE post_id = :id", id=post_id)
         DB.query("DELETE FROM hive_post_tags   WHERE post_id = :id", id=post_id)
+        Community.track_payout(post_id, None, author)
+        cls._fingerprints.forget(post_id, GROUPS)
 
         # if it was queued for a write, remove it
         url = author+'/'+permlink
         log.warning("deleting %s", url) #173
-        if url in cls._queue:
-            del cls._queue[url]
+        if cls._queue.remove(url):
             log.warning("deleted %s", url) #173
             if url in cls._ids:
                 del cls._ids[url]
@@ -185,9 +209,6 @@ class CachedPost:
             summary = ', '.join(summary) if summary else 'none'
             log.info("[PREP] posts cache process: %s", summary)
 
-        for url, _, _ in tuples:
-            del cls._queue[url]
-
         cls._update_batch(steem, tuples, trx, full_total=full_total)
 
         for url, _, _ in tuples:
@@ -198,17 +219,24 @@ class CachedPost:
 
     @classmethod
     def _get_tuples_for_level(cls, level, fraction=1):
-        """Query tuples to be updated.
+        """Dequeue tuples to be updated.
 
         Given a specific flush level (insert, payout, update, upvote),
-        returns a list of tuples to be passed to _update_batch, in the
-        form of: `[(url, id, level)*]`
+        removes its posts from the queue and returns a list of tuples
+        to be passed to _update_batch, in the form of:
+        `[(url, id, level)*]`
         """
         mode = LEVELS.index(level)
-        urls = [url for url, i in cls._queue.items() if i == mode]
+        count = None
         if fraction > 1 and level != 'insert': # inserts must be full flush
-            urls = urls[0:math.ceil(len(urls) / fraction)]
-        return [(url, cls._get_id(url), level) for url in urls]
+            count = math.ceil(cls._queue.depth(mode) / fraction)
+        return [(url, cls._get_id(url), level)
+                for url in cls._queue.take(mode, count)]
+
+    @classmethod
+    def queue_depths(cls):
+        """Get the number of dirty posts queued, by level."""
+        return dict(zip(LEVELS, cls._queue.depths()))
 
     @classmethod
     def _load_noids(cls):
@@ -228,9 +256,26 @@ class CachedPost:
         cls._noids = set()
         return len(tuples)
 
+    @classmethod
+    def _payout_schedule(cls):
+        """Get the payout schedule, loading unpaid posts on first use.
+
+        Once loaded, it is kept current by `_sql` as cache rows with
+        a (new) `payout_at` are written.
+        """
+        if cls._payouts is None:
+            payouts = PayoutSchedule()
+            sql = """SELECT post_id, payout_at FROM hive_posts_cache
+                      WHERE is_paidout = '0'"""
+            for pid, payout_at in DB.query_stream(sql):
+                payouts.add(pid, _timestamp(payout_at))
+            log.info("[INIT] loaded %d pending payouts", len(payouts))
+            cls._payouts = payouts
+        return cls._payouts
+
     @classmethod
     def _select_paidout_tuples(cls, date):
-        """Query hive_posts_cache for payout sweep.
+        """Find posts due for payout sweep.
 
         Select all posts which should have been paid out before `date`
         yet do not have the `is_paidout` flag set. We perform this
@@ -238,18 +283,23 @@ class CachedPost:
         state. Since payout values vary even between votes, we'd have
         stale data if we didn't sweep, and only waited for incoming
         votes before an update.
+
+        Candidates come from the in-memory payout schedule; the db is
+        only queried when some are due, to re-check and load urls.
         """
         from hive.indexer.posts import Posts
 
-        sql = """SELECT post_id FROM hive_posts_cache
-                  WHERE is_paidout = '0' AND payout_at <= :date"""
-        ids = DB.query_col(sql, date=date)
+        ids = cls._payout_schedule().pop_due(_timestamp(date))
         if not ids:
             return []
 
-        sql = """SELECT id, author, permlink
-                 FROM hive_posts WHERE id IN :ids"""
-        results = DB.query_all(sql, ids=tuple(ids))
+        sql = """SELECT hp.id, hp.author, hp.permlink
+                   FROM hive_posts hp
+                   JOIN hive_posts_cache hpc ON hpc.post_id = hp.id
+                  WHERE hp.id IN :ids
+                    AND hpc.is_paidout = '0'
+                    AND hpc.payout_at <= :date"""
+        results = DB.query_all(sql, ids=tuple(ids), date=date)
         return Posts.save_ids_from_tuples(results)
 
     @classmethod
@@ -329,19 +379,39 @@ class CachedPost:
         seen the delete op yet). So even when the post is not found
         (i.e. `not post['author']`), it's important to advance _last_id,
         because this cursor is used to deduce any missing cache entries.
-        """
-        # pylint: disable=too-many-locals
 
+        When there is more than one batch, the next batch is fetched
+        from steemd while the current one is processed and written.
+        Batches are still handled in order.
+        """
         timer = Timer(total=len(tuples), entity='post',
                       laps=['rps', 'wps'], full_total=full_total)
         tuples = sorted(tuples, key=lambda x: x[1]) # enforce ASC id's
 
-        for tups in partition_all(1000, tuples):
+        def _fetch(tups):
+            post_args = [tup[0].split('/') for tup in tups]
+            return tups, steem.get_content_batch(post_args)
+
+        batches = map(_fetch, partition_all(1000, tuples))
+        queue = Prefetch(batches, depth=1) if len(tuples) > 1000 else None
+        try:
+            cls._process_batches(queue or batches, timer, trx, len(tuples))
+        finally:
+            if queue:
+                queue.close()
+
+    @classmethod
+    def _process_batches(cls, batches, timer, trx, total):
+        """Process and write fetched `(tups, posts)` batches, in order."""
+        # pylint: disable=too-many-locals
+        while True:
             timer.batch_start()
-            buffer = []
+            batch = next(batches, None)
+            if not batch:
+                break
+            tups, posts = batch
+            inserts, updates, buffer = [], [], []
 
-            post_args = [tup[0].split('/') for tup in tups]
-            posts = steem.get_content_batch(post_args)
             post_ids = [tup[1] for tup in tups]
             post_levels = [tup[2] for tup in tups]
 
@@ -355,7 +425,10 @@ class CachedPost:
                         post['community_id'] = core['community_id']
                         post['gray'] = core['is_muted']
                         post['hide'] = not core['is_valid']
-                    buffer.extend(cls._sql(pid, post, level=level))
+                    values, sqls = cls._sql(pid, post, level=level)
+                    if values:
+                        (inserts if level == 'insert' else updates).append(values)
+                    buffer.extend(sqls)
                 else:
                     # When a post has been deleted (or otherwise DNE),
                     # steemd simply returns a blank post  object w/ all
@@ -383,10 +456,16 @@ class CachedPost:
                 cls._bump_last_id(pid)
 
             timer.batch_lap()
-            DB.batch_queries(buffer, trx)
+            DB.batch_queries(cls._bulk_sqls(inserts, updates)
+                             + cls._tag_sqls() + buffer, trx)
+
+            # notifs are deduped against hive_notifs (see `_flush_notifs`);
+            # a post appears at most once per batch.
+            cls._flush_notifs()
+            Notify.flush()
 
             timer.batch_finish(len(posts))
-            if len(tuples) >= 1000:
+            if total >= 1000:
                 log.info(timer.batch_status())
 
     @classmethod
@@ -450,7 +529,13 @@ class CachedPost:
 
     @classmethod
     def _sql(cls, pid, post, level=None):
-        """Given a post and "update level", generate SQL edit statement.
+        """Given a post and "update level", generate its cache row.
+
+        Returns `(values, sqls)`: the `hive_posts_cache` column values
+        to insert or update (see `_bulk_sqls`), and any related ad SQL
+        statement. Tag changes are queued for `_tag_sqls`. Columns which
+        are unchanged since last written are left out, and `values` is
+        None if none changed.
 
         Valid levels are:
          - `insert`: post does not yet exist in cache
@@ -505,6 +590,10 @@ class CachedPost:
                 ('raw_json',      json.dumps(post_legacy(post))),
             ])
 
+            # (re)schedule payout sweep
+            if not basic['is_paidout'] and cls._payouts is not None:
+                cls._payouts.add(pid, _timestamp(basic['payout_at']))
+
         # if there's a pending promoted value to write, pull it out
         if pid in cls._pending_promoted:
             bal = cls._pending_promoted.pop(pid)
@@ -538,11 +627,15 @@ class CachedPost:
             ('children',    min(post['children'], 32767)),
         ])
 
+        # keep community pending payout totals current
+        is_paidout = post['cashout_time'][0:4] == '1969'
+        Community.track_payout(pid, post['community_id'], post['author'],
+                               None if is_paidout else payout['payout'])
+
         # update tags if action is insert/update and is root post
-        tag_sqls = []
         if level in ['insert', 'update'] and not post['depth']:
             diff = level != 'insert' # do not attempt tag diff on insert
-            tag_sqls.extend(cls._tag_sqls(pid, basic['tags'], diff=diff))
+            cls._tag_queue[pid] = (basic['tags'], diff)
 
         # if recounting, update the parent next pass.
         if level == 'recount' and post['depth']:
@@ -551,23 +644,71 @@ class CachedPost:
         # trigger any notifications
         cls._notifs(post, pid, level, payout['payout'])
 
-        # build the post insert/update SQL, add tag SQLs
         if level == 'insert':
-            sql = cls._insert(values)
             # process new native ad, if valid
             ad_sql = NativeAd.process_ad(values, acc_id)
         else:
-            sql = cls._update(values)
             # update ad content, if draft(0) in all communities
             ad_sql = NativeAd.process_ad(values, acc_id, new=False)
 
+        # drop unchanged columns
+        values = cls._changed(pid, values, level)
+
         # return ad SQL only if it is present
         if ad_sql is not None:
-            _final = [sql] + tag_sqls + [ad_sql]
-        else:
-            _final = [sql] + tag_sqls
+            return values, [ad_sql]
+        return values, []
+
+    @classmethod
+    def _changed(cls, pid, values, level):
+        """Drop column groups unchanged since they were last written.
+
+        Returns None if there is nothing to write. Inserts are always
+        written in full (their fingerprints are still recorded).
+        """
+        groups = collections.OrderedDict((group, []) for group in GROUPS)
+        for col, val in values[1:]:
+            groups[COLUMN_GROUPS.get(col, 'row')].append((col, val))
+
+        out = values[:1]
+        for group, cols in groups.items():
+            if not cols:
+                continue
+            if cls._fingerprints.changed(pid, group, cols) or level == 'insert':
+                out.extend(cols)
+        return out if len(out) > 1 else None
+
+    @classmethod
+    def clear_cache(cls):
+        """Drop cached ids, queues and fingerprints, e.g. after a fork.
 
-        return _final
+        Queued entries may refer to rewound posts, and the payout
+        schedule no longer reflects rewound payouts; it is reloaded
+        on the next sweep."""
+        cls._ids = {}
+        cls._noids = set()
+        cls._last_id = -1
+        cls._queue = LevelQueue(len(LEVELS))
+        cls._pending_promoted = {}
+        cls._votes = {}
+        cls._notif_queue = []
+        cls._tag_queue = {}
+        cls._payouts = None
+        cls._fingerprints.clear()
+
+    @classmethod
+    def _bulk_sqls(cls, inserts, updates):
+        """Group cache rows sharing a column set into bulk statements."""
+        sqls = []
+        for rows, build in ((inserts, cls._insert_many),
+                            (updates, cls._update_many)):
+            groups = collections.OrderedDict()
+            for values in rows:
+                cols = tuple(k for k, _ in values)
+                groups.setdefault(cols, []).append(values)
+            for group in groups.values():
+                sqls.extend(map(build, partition_all(500, group)))
+        return sqls
 
     @classmethod
     def _notifs(cls, post, pid, level, payout):
@@ -577,14 +718,17 @@ class CachedPost:
         parent_author = post['parent_author']
         date = post['last_update']
 
+        # candidates are checked in bulk for mutes & dupes by _flush_notifs
+        queue = cls._notif_queue
+
         # reply notif
         if level == 'insert' and parent_author and parent_author != author:
             parent_author_id = Accounts.get_id(parent_author)
-            if not cls._muted(parent_author_id, author_id):
-                ntype = 'reply' if post['depth'] == 1 else 'reply_comment'
-                Notify(ntype, src_id=author_id, dst_id=parent_author_id,
-                       score=Accounts.default_score(author), post_id=pid,
-                       when=date).write()
+            ntype = 'reply' if post['depth'] == 1 else 'reply_comment'
+            queue.append((Notify(ntype, src_id=author_id, dst_id=parent_author_id,
+                                 score=Accounts.default_score(author), post_id=pid,
+                                 when=date),
+                          (parent_author_id, author_id), None))
 
         # mentions notif
         if level in ('insert', 'update'):
@@ -598,11 +742,11 @@ class CachedPost:
                 penalty = min([score, 2 * (len(accounts) - 1)])
                 for mention in accounts:
                     mention_id = Accounts.get_id(mention)
-                    if (not cls._mentioned(pid, mention_id)
-                            and not cls._muted(mention_id, author_id)):
-                        Notify('mention', src_id=author_id,
-                               dst_id=mention_id, post_id=pid, when=date,
-                               score=(score - penalty)).write()
+                    queue.append((Notify('mention', src_id=author_id,
+                                         dst_id=mention_id, post_id=pid, when=date,
+                                         score=(score - penalty)),
+                                  (mention_id, author_id),
+                                  (16, pid, mention_id, None)))
             else:
                 url = '@%s/%s' % (author, post['permlink'])
                 log.info("skip %d mentions in %s", len(accounts), url)
@@ -621,69 +765,103 @@ class CachedPost:
                 if contrib < 1: continue # < $0.001
 
                 voter_id = Accounts.get_id(vote['voter'])
-                if not cls._voted(pid, author_id, voter_id):
-                    score = min(100, (len(str(contrib)) - 1) * 25) # $1 = 75
-                    payload = "$%.3f" % (contrib / 1000)
-                    Notify('vote', src_id=voter_id, dst_id=author_id,
-                           when=vote['time'], post_id=pid, score=score,
-                           payload=payload).write()
-
-
-    @classmethod
-    def _muted(cls, account, target):
-        # TODO: optimize (mem cache?)
-        sql = """SELECT 1 FROM hive_follows
-                  WHERE follower = :account
-                    AND following = :target
-                    AND state = 2"""
-        return DB.query_col(sql, account=account, target=target)
-
-    @classmethod
-    def _voted(cls, post_id, account_id, voter_id):
-        sql = """SELECT 1
-                   FROM hive_notifs
-                  WHERE dst_id = :dst_id
-                    AND src_id = :src_id
-                    AND post_id = :post_id
-                    AND type_id = 17"""
-        return bool(DB.query_one(sql, dst_id=account_id,
-                                 post_id=post_id, src_id=voter_id))
-
-    @classmethod
-    def _mentioned(cls, post_id, account_id):
-        sql = """SELECT 1
-                   FROM hive_notifs
-                  WHERE dst_id = :dst_id
-                    AND post_id = :post_id
-                    AND type_id = 16"""
-        return bool(DB.query_one(sql, dst_id=account_id, post_id=post_id))
-
-    @classmethod
-    def _tag_sqls(cls, pid, tags, diff=True):
-        """Generate SQL "deltas" for a post_id's associated tags."""
-        next_tags = set(tags)
-        curr_tags = set()
-        if diff:
-            sql = "SELECT tag FROM hive_post_tags WHERE post_id = :id"
-            curr_tags = set(DB.query_col(sql, id=pid))
-
-        to_rem = (curr_tags - next_tags)
-        if to_rem:
-            sql = "DELETE FROM hive_post_tags WHERE post_id = :id AND tag IN :tags"
-            yield (sql, dict(id=pid, tags=tuple(to_rem)))
+                score = min(100, (len(str(contrib)) - 1) * 25) # $1 = 75
+                payload = "$%.3f" % (contrib / 1000)
+                queue.append((Notify('vote', src_id=voter_id, dst_id=author_id,
+                                     when=vote['time'], post_id=pid, score=score,
+                                     payload=payload),
+                              None, (17, pid, author_id, voter_id)))
+
+    @classmethod
+    def _flush_notifs(cls):
+        """Write queued notif candidates, skipping muted and dupes.
+
+        Candidates carry an optional mute key `(dst_id, src_id)`,
+        vetoed if dst has muted src, and an optional seen key
+        `(type_id, post_id, dst_id, src_id)` for mention (src ignored)
+        and vote notifs which must not be sent twice. Both are
+        resolved with one query each for the whole batch.
+        """
+        queue, cls._notif_queue = cls._notif_queue, []
+        if not queue:
+            return
+
+        muted = set()
+        mute_keys = {mute for _, mute, _ in queue if mute}
+        if mute_keys:
+            sql = """SELECT follower, following FROM hive_follows
+                      WHERE follower IN :dsts AND following IN :srcs
+                        AND state = 2"""
+            rows = DB.query_all(sql, dsts=tuple({k[0] for k in mute_keys}),
+                                srcs=tuple({k[1] for k in mute_keys}))
+            muted = {(row[0], row[1]) for row in rows}
+
+        seen = set()
+        pids = {key[1] for _, _, key in queue if key}
+        if pids:
+            sql = """SELECT type_id, post_id, dst_id, src_id FROM hive_notifs
+                      WHERE post_id IN :pids AND type_id IN (16, 17)"""
+            for type_id, pid, dst_id, src_id in DB.query_all(sql, pids=tuple(pids)):
+                seen.add((type_id, pid, dst_id, src_id if type_id == 17 else None))
+
+        for notify, mute_key, seen_key in queue:
+            if mute_key in muted or seen_key in seen:
+                continue
+            notify.write()
+
+    @classmethod
+    def _tag_sqls(cls):
+        """Generate SQL "deltas" for all queued posts' tags.
+
+        Current tags of posts to diff are loaded with one query; all
+        removals are done in one delete, additions in bulk inserts.
+        """
+        queue, cls._tag_queue = cls._tag_queue, {}
+        if not queue:
+            return []
+
+        to_rem, to_add = cls._tag_diff(queue)
 
-        to_add = (next_tags - curr_tags)
-        if to_add:
-            params = _keyify(to_add)
-            vals = ["(:id, :%s)" % key for key in params.keys()]
+        sqls = []
+        if to_rem:
+            sql = "DELETE FROM hive_post_tags WHERE (post_id, tag) IN :pairs"
+            sqls.append((sql, {'pairs': tuple(to_rem)}))
+
+        for batch in partition_all(1000, to_add):
+            params, vals = {}, []
+            for idx, (pid, tag) in enumerate(batch):
+                vals.append("(:id_%d, :tag_%d)" % (idx, idx))
+                params.update({'id_%d' % idx: pid, 'tag_%d' % idx: tag})
             sql = "INSERT INTO hive_post_tags (post_id, tag) VALUES %s"
             sql += " ON CONFLICT DO NOTHING" # (conflicts due to collation)
-            yield (sql % ','.join(vals), {'id': pid, **params})
+            sqls.append((sql % ','.join(vals), params))
+        return sqls
+
+    @classmethod
+    def _tag_diff(cls, queue):
+        """Get `(pid, tag)` pairs to remove and to add for queued posts."""
+        curr = collections.defaultdict(set)
+        diff_ids = tuple(pid for pid, (_, diff) in queue.items() if diff)
+        if diff_ids:
+            sql = "SELECT post_id, tag FROM hive_post_tags WHERE post_id IN :ids"
+            for pid, tag in DB.query_all(sql, ids=diff_ids):
+                curr[pid].add(tag)
+
+        to_rem, to_add = [], []
+        for pid, (tags, _) in queue.items():
+            next_tags = set(tags)
+            to_rem.extend((pid, tag) for tag in curr[pid] - next_tags)
+            to_add.extend((pid, tag) for tag in next_tags - curr[pid])
+        return to_rem, to_add
 
     @classmethod
     def _insert(cls, values):
         return DB.build_insert('hive_posts_cache', values, pk='post_id')
 
     @classmethod
-    def _update(cls, values):
-        return DB.build_update('hive_posts_cache', values, pk='post_id')
+    def _insert_many(cls, rows):
+        return DB.build_bulk_insert('hive_posts_cache', rows)
+
+    @classmethod
+    def _update_many(cls, rows):
+        return DB.build_bulk_update('hive_posts_cache', rows, pk='post_id')
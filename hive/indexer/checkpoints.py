@@ -0,0 +1,293 @@
+"""Reads and writes blocks from checkpoint files on disk.
+
+Two formats are supported:
+
+ - `(block_num).json.lst`: one JSON block per line (legacy)
+ - `(block_num).json.z`: zlib-compressed frames of trimmed blocks,
+   with a sidecar `(block_num).json.z.idx` offset index for seeking
+
+In both cases `block_num` is the last block contained in the file.
+"""
+
+import os
+import glob
+import zlib
+import struct
+import logging
+import multiprocessing
+from collections import deque
+from contextlib import ExitStack
+
+import ujson as json
+from funcy.seqs import drop
+from toolz import concat, partition_all
+
+from hive.utils.timer import Timer
+from hive.utils.prefetch import Prefetch
+
+# pylint: disable=too-many-lines
+
+log = logging.getLogger(__name__)
+
+LEGACY_EXT = '.json.lst'
+PACKED_EXT = '.json.z'
+INDEX_EXT = '.idx'
+
+# index header: magic, version, first block num, blocks per frame
+INDEX_HEADER = struct.Struct('<4sIII')
+INDEX_MAGIC = b'HVCK'
+INDEX_VERSION = 1
+
+# index entry: frame offset, frame length (in bytes)
+INDEX_ENTRY = struct.Struct('<QI')
+
+# blocks per `get_blocks_range` call when dumping
+DUMP_CHUNK_SIZE = 1000
+
+def checkpoint_dir():
+    """Get the path of hive's `checkpoints` directory."""
+    basedir = os.path.dirname(os.path.realpath(__file__ + "/../.."))
+    return basedir + "/checkpoints"
+
+def list_checkpoints(path=None):
+    """List checkpoint files as `[(last_block_num, path)*]`, sorted."""
+    def tuplize(path):
+        return (int(path.split('/')[-1].split('.')[0]), path)
+    path = path or checkpoint_dir()
+    files = {}
+    # if a file exists in both formats, the packed one takes precedence
+    for ext in (LEGACY_EXT, PACKED_EXT):
+        files.update(map(tuplize, glob.glob(path + "/*" + ext)))
+    return sorted(files.items(), key=lambda f: f[0])
+
+def trim_block(block):
+    """Strip a block down to the fields used by `Blocks._process`."""
+    return {'block_id': block['block_id'],
+            'previous': block['previous'],
+            'timestamp': block['timestamp'],
+            'transactions': [{'operations': tx['operations']}
+                             for tx in block['transactions']]}
+
+def _load_lines(lines):
+    """Decode a chunk of JSON-lines blocks."""
+    return [json.loads(line) for line in lines]
+
+def _load_lines_trimmed(lines):
+    """Decode a chunk of JSON-lines blocks; trim them for transfer."""
+    return [trim_block(json.loads(line)) for line in lines]
+
+def _load_frame(data):
+    """Decompress and decode a packed frame of blocks."""
+    return [json.loads(line) for line in zlib.decompress(data).splitlines()]
+
+def _read_index(path):
+    """Read a packed file's index as `(first_block, frame_size, entries)`."""
+    with open(path + INDEX_EXT, 'rb') as f:
+        raw = f.read()
+    magic, version, first, frame_size = INDEX_HEADER.unpack_from(raw)
+    assert magic == INDEX_MAGIC, "invalid checkpoint index %s" % path
+    assert version == INDEX_VERSION, "unknown index version %d" % version
+    entries = list(INDEX_ENTRY.iter_unpack(raw[INDEX_HEADER.size:]))
+    return first, frame_size, entries
+
+class CheckpointWriter:
+    """Writes blocks to a packed (`.json.z`) checkpoint file.
+
+    Blocks must be appended in order starting at `first_block`. They
+    are trimmed, grouped into frames of `frame_size` and compressed.
+    Output goes to temporary files which are renamed into place by
+    `close()`, so a partially written checkpoint is never picked up.
+    Files are open from construction until `close()` or `abort()`;
+    use as a context manager to ensure either is called.
+    """
+
+    # zlib compression level
+    LEVEL = 6
+
+    def __init__(self, path, first_block, frame_size=1000):
+        assert path.endswith(PACKED_EXT), "invalid path %s" % path
+        self._path = path
+        self._next = first_block
+        self._frame = []
+        self._frame_size = frame_size
+        self._files = ExitStack()
+        self._data = self._files.enter_context(open(path + '.tmp', 'wb'))
+        self._index = self._files.enter_context(
+            open(path + INDEX_EXT + '.tmp', 'wb'))
+        self._index.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION,
+                                            first_block, frame_size))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, value, traceback):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+    def append(self, block):
+        """Add the next block to the checkpoint."""
+        num = int(block['block_id'][:8], base=16)
+        assert num == self._next, "expected block %d, got %d" % (self._next, num)
+        self._next += 1
+        self._frame.append(json.dumps(trim_block(block)))
+        if len(self._frame) == self._frame_size:
+            self._write_frame()
+
+    def last_num(self):
+        """Get the number of the last appended block."""
+        return self._next - 1
+
+    def _write_frame(self):
+        data = zlib.compress("\n".join(self._frame).encode('utf8'), self.LEVEL)
+        self._index.write(INDEX_ENTRY.pack(self._data.tell(), len(data)))
+        self._data.write(data)
+        self._frame = []
+
+    def close(self):
+        """Write the last frame and move files into place."""
+        if self._frame:
+            self._write_frame()
+        self._files.close()
+        os.rename(self._path + INDEX_EXT + '.tmp', self._path + INDEX_EXT)
+        os.rename(self._path + '.tmp', self._path)
+
+    def abort(self):
+        """Discard everything written so far."""
+        self._files.close()
+        os.remove(self._path + '.tmp')
+        os.remove(self._path + INDEX_EXT + '.tmp')
+
+def pack_checkpoint(path, frame_size=1000):
+    """Convert a legacy `.json.lst` checkpoint to the packed format."""
+    assert path.endswith(LEGACY_EXT), "invalid path %s" % path
+    out = path[:-len(LEGACY_EXT)] + PACKED_EXT
+    with open(path, encoding='utf8') as f:
+        first = json.loads(f.readline())
+        num = int(first['block_id'][:8], base=16)
+        with CheckpointWriter(out, num, frame_size) as writer:
+            writer.append(first)
+            for line in f:
+                writer.append(json.loads(line))
+    return out
+
+def dump_checkpoints(steem, span, last_block, path=None, prefetch=2):
+    """Archive blocks from steemd into packed checkpoint files.
+
+    Each file covers `span` blocks. Dumping resumes after the last
+    complete checkpoint found in `path`; only full spans ending at or
+    before `last_block` are written. Returns the number of files.
+    """
+    path = path or checkpoint_dir()
+    existing = list_checkpoints(path)
+    lbound = existing[-1][0] + 1 if existing else 1
+    files = (last_block - lbound + 1) // span
+    if files < 1:
+        log.info("[DUMP] nothing to dump; next file would end at block %d",
+                 lbound + span - 1)
+        return 0
+
+    log.info("[DUMP] start block %d, %d files of %d blocks", lbound, files, span)
+    timer = Timer(files * span, entity='block', laps=['rps', 'wps'])
+    for _ in range(files):
+        ubound = lbound + span
+        out = "%s/%d%s" % (path, ubound - 1, PACKED_EXT)
+        _dump_file(steem, range(lbound, ubound), out, timer, prefetch)
+        log.info("[DUMP] wrote %s", out)
+        lbound = ubound
+    return files
+
+def _dump_file(steem, block_nums, out, timer, prefetch):
+    """Fetch `block_nums` in chunks of `DUMP_CHUNK_SIZE`; write to `out`."""
+    lbound, ubound = block_nums[0], block_nums[-1] + 1
+    nums = block_nums[::DUMP_CHUNK_SIZE]
+    chunks = (steem.get_blocks_range(num, min(num + DUMP_CHUNK_SIZE, ubound))
+              for num in nums)
+    with Prefetch(chunks, prefetch) as queue, \
+            CheckpointWriter(out, lbound) as writer:
+        for _ in nums:
+            timer.batch_start()
+            blocks = next(queue)
+            timer.batch_lap()
+            for block in blocks:
+                writer.append(block)
+            timer.batch_finish(len(blocks))
+            _prefix = ("[DUMP] Got block %d @ %s" % (
+                writer.last_num(), blocks[-1]['timestamp']))
+            log.info(timer.batch_status(_prefix))
+
+class CheckpointReader:
+    """Streams blocks from checkpoint files in chunks.
+
+    With `workers` > 0, decoding is done in a process pool. Results
+    are returned in file order, and at most `2 * workers` chunks are
+    in flight at any time so the reader never runs far ahead of the
+    indexer. Blocks decoded by workers are trimmed (see `trim_block`)
+    to keep inter-process transfer cheap.
+    """
+
+    def __init__(self, workers=0, chunk_size=1000):
+        assert workers >= 0, "workers must be non-negative"
+        self._workers = workers
+        self._chunk_size = chunk_size
+        self._pool = None
+
+    def __enter__(self):
+        if self._workers:
+            ctx = multiprocessing.get_context('spawn')
+            self._pool = ctx.Pool(self._workers)
+            log.info("[SYNC] decoding checkpoints with %d workers",
+                     self._workers)
+        return self
+
+    def __exit__(self, exc_type, value, traceback):
+        if self._pool:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def read(self, path, skip=0):
+        """Yield lists of blocks from `path`, skipping `skip` blocks."""
+        if path.endswith(PACKED_EXT):
+            return self._read_packed(path, skip)
+        return self._read_legacy(path, skip)
+
+    def _read_packed(self, path, skip):
+        """Seek to the frame containing block `skip`, decode from there."""
+        _, frame_size, entries = _read_index(path)
+        start = skip // frame_size
+        with open(path, 'rb') as f:
+            def frames():
+                for offset, length in entries[start:]:
+                    f.seek(offset)
+                    yield f.read(length)
+
+            if self._pool:
+                decoded = self._map(_load_frame, frames())
+            else:
+                decoded = map(_load_frame, frames())
+            blocks = drop(skip - start * frame_size, concat(decoded))
+            for chunk in partition_all(self._chunk_size, blocks):
+                yield list(chunk)
+
+    def _read_legacy(self, path, skip):
+        """Stream JSON lines, skipping the first `skip` lines."""
+        with open(path, encoding='utf8') as f:
+            # each line in file represents one block
+            remaining = drop(skip, f)
+            chunks = partition_all(self._chunk_size, remaining)
+            if self._pool:
+                yield from self._map(_load_lines_trimmed, chunks)
+            else:
+                yield from map(_load_lines, chunks)
+
+    def _map(self, func, tasks):
+        """Ordered, bounded `map` over the process pool."""
+        pending = deque()
+        for task in tasks:
+            pending.append(self._pool.apply_async(func, (task,)))
+            if len(pending) >= 2 * self._workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
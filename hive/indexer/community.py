@@ -4,8 +4,10 @@
 
 import logging
 import re
+from decimal import Decimal, ROUND_HALF_UP
 from enum import IntEnum
 import ujson as json
+from toolz import partition_all
 
 from hive.db.adapter import Db
 from hive.indexer.accounts import Accounts
@@ -51,6 +53,14 @@ LANGS = ("ab,aa,af,ak,sq,am,ar,an,hy,as,av,ae,ay,az,bm,ba,eu,be,bn,bh,bi,"
          "st,es,su,sw,ss,sv,ta,te,tg,th,ti,bo,tk,tl,tn,to,tr,ts,tt,tw,ty,"
          "ug,uk,ur,uz,ve,vi,vo,wa,cy,wo,fy,xh,yi,yo,za").split(',')
 
+# community rank order: by pending payouts, then authors, posts, subs
+_RANK_ORDER = """ORDER BY sum_pending DESC,
+                          num_authors DESC,
+                          num_pending DESC,
+                          subscribers DESC,
+                          (CASE WHEN title = '' THEN 1 ELSE 0 END),
+                          id"""
+
 def assert_keys_match(keys, expected, allow_missing=True):
     """Compare a set of input keys to expected keys."""
     if not allow_missing:
@@ -105,6 +115,17 @@ class Community:
     # id -> name map
     _names = {}
 
+    # pending community posts {pid: (cid, author, payout)}, with payouts in
+    # thousandths; loaded by a full recalc, then kept current by CachedPost
+    _pending = {}
+    _pending_loaded = False
+
+    # pending totals by community {cid: [posts, payout (thousandths), {author: posts}]}
+    _totals = {}
+
+    # communities whose totals changed since last recalc
+    _dirty_totals = set()
+
     @classmethod
     def register(cls, names, block_date):
         """Block processing: hooks into new account registration.
@@ -225,40 +246,130 @@ class Community:
             return role >= Role.member
         return role >= Role.guest # or at least not muted
 
+    @staticmethod
+    def _milli(amount):
+        """Get an amount as integer thousandths, as stored in a
+        `DECIMAL(10, 3)` column (rounded half away from zero)."""
+        amount = Decimal(str(amount)).quantize(Decimal('0.001'), ROUND_HALF_UP)
+        return int(amount * 1000)
+
     @classmethod
-    def recalc_pending_payouts(cls):
-        """Update all pending payout and rank fields."""
-        sql = """SELECT id,
-                        COALESCE(posts, 0),
-                        COALESCE(payouts, 0),
-                        COALESCE(authors, 0)
-                   FROM hive_communities c
-              LEFT JOIN (
-                             SELECT community_id,
-                                    COUNT(*) posts,
-                                    ROUND(SUM(payout)) payouts,
-                                    COUNT(DISTINCT author) authors
-                               FROM hive_posts_cache
-                              WHERE community_id IS NOT NULL
-                                AND is_paidout = '0'
-                           GROUP BY community_id
-                        ) p
-                     ON community_id = id
-               ORDER BY COALESCE(payouts, 0) DESC,
-                        COALESCE(authors, 0) DESC,
-                        COALESCE(posts, 0) DESC,
-                        subscribers DESC,
-                        (CASE WHEN c.title = '' THEN 1 ELSE 0 END)
+    def track_payout(cls, pid, community_id, author, payout=None):
+        """Update pending totals with a post's current payout.
+
+        Pass a `payout` of None when the post is paid out or deleted.
+        No-op until pending posts are loaded by a full recalc.
         """
+        if not cls._pending_loaded:
+            return
+        old = cls._pending.pop(pid, None)
+        if old:
+            cls._adjust_totals(*old, sign=-1)
+        if community_id and payout is not None:
+            payout = cls._milli(payout)
+            cls._pending[pid] = (community_id, author, payout)
+            cls._adjust_totals(community_id, author, payout, sign=1)
 
-        for rank, row in enumerate(DB.query_all(sql)):
-            cid, posts, payouts, authors = row
-            sql = """UPDATE hive_communities
-                        SET sum_pending = :payouts, num_pending = :posts,
-                            num_authors = :authors, rank = :rank
-                      WHERE id = :id"""
-            DB.query(sql, id=cid, payouts=payouts, posts=posts,
-                     authors=authors, rank=rank+1)
+    @classmethod
+    def _adjust_totals(cls, cid, author, payout, sign):
+        """Apply a post's payout (in thousandths) to its community."""
+        totals = cls._totals.setdefault(cid, [0, 0, {}])
+        totals[0] += sign
+        totals[1] += sign * payout
+        authors = totals[2]
+        count = authors.get(author, 0) + sign
+        if count:
+            authors[author] = count
+        else:
+            del authors[author]
+        cls._dirty_totals.add(cid)
+
+    @classmethod
+    def _load_pending(cls):
+        """Load pending payouts of community posts from the db."""
+        sql = """SELECT post_id, community_id, author, payout
+                   FROM hive_posts_cache
+                  WHERE community_id IS NOT NULL
+                    AND is_paidout = '0'"""
+        cls._pending = {}
+        cls._totals = {}
+        for pid, cid, author, payout in DB.query_stream(sql):
+            payout = cls._milli(payout)
+            cls._pending[pid] = (cid, author, payout)
+            cls._adjust_totals(cid, author, payout, sign=1)
+        cls._dirty_totals = set()
+        cls._pending_loaded = True
+
+    @classmethod
+    def recalc_pending_payouts(cls, full=True):
+        """Update all pending payout and rank fields.
+
+        A full recalc aggregates all pending posts in the db, and
+        (re)loads the in-memory totals. Otherwise, only communities
+        whose totals changed since the last recalc are written, and
+        all communities are then re-ranked.
+        """
+        if full or not cls._pending_loaded:
+            cls._recalc_full()
+            cls._load_pending()
+            return
+
+        if cls._dirty_totals:
+            rows = []
+            for cid in sorted(cls._dirty_totals):
+                posts, payout, authors = cls._totals[cid]
+                # same as ROUND(SUM(payout)) for non-negative payouts
+                rows.append([('id', cid),
+                             ('sum_pending', (payout + 500) // 1000),
+                             ('num_pending', posts),
+                             ('num_authors', len(authors))])
+            DB.batch_queries([DB.build_bulk_update('hive_communities', chunk, pk='id')
+                              for chunk in partition_all(500, rows)], trx=False)
+            cls._dirty_totals = set()
+
+        sql = """UPDATE hive_communities hc
+                    SET rank = r.rank
+                   FROM (SELECT id, ROW_NUMBER() OVER (%s) AS rank
+                           FROM hive_communities) r
+                  WHERE hc.id = r.id AND hc.rank != r.rank""" % _RANK_ORDER
+        DB.query(sql)
+
+    @classmethod
+    def _recalc_full(cls):
+        """Aggregate pending posts and rank communities, in one update."""
+        sql = """UPDATE hive_communities hc
+                    SET sum_pending = r.sum_pending,
+                        num_pending = r.num_pending,
+                        num_authors = r.num_authors,
+                        rank = r.rank
+                   FROM (
+                         SELECT id, sum_pending, num_pending, num_authors,
+                                ROW_NUMBER() OVER (%s) AS rank
+                           FROM (
+                                 SELECT c.id, c.title, c.subscribers,
+                                        COALESCE(payouts, 0) sum_pending,
+                                        COALESCE(posts, 0) num_pending,
+                                        COALESCE(authors, 0) num_authors
+                                   FROM hive_communities c
+                              LEFT JOIN (
+                                         SELECT community_id,
+                                                COUNT(*) posts,
+                                                ROUND(SUM(payout)) payouts,
+                                                COUNT(DISTINCT author) authors
+                                           FROM hive_posts_cache
+                                          WHERE community_id IS NOT NULL
+                                            AND is_paidout = '0'
+                                       GROUP BY community_id
+                                        ) p
+                                     ON community_id = c.id
+                                ) t
+                        ) r
+                  WHERE hc.id = r.id
+                    AND (hc.sum_pending, hc.num_pending, hc.num_authors, hc.rank)
+                        IS DISTINCT FROM
+                        (r.sum_pending, r.num_pending, r.num_authors, r.rank)
+        """ % _RANK_ORDER
+        DB.query(sql)
 
 class CommunityOp:
     """Handles validating and processing of community custom_json ops."""
@@ -656,6 +767,11 @@ class CommunityOp:
     def _flagged(self):
         """Check user's flag status."""
         from hive.indexer.notify import NotifyType
+        if Notify.is_pending(community_id=self.community_id,
+                             post_id=self.post_id,
+                             type_id=NotifyType['flag_post'],
+                             src_id=self.actor_id):
+            return True
         sql = """SELECT 1 FROM hive_notifs
                   WHERE community_id = :community_id
                     AND post_id = :post_id
@@ -4,6 +4,7 @@ import logging
 from funcy.seqs import first, second
 from hive.db.adapter import Db
 from hive.db.db_state import DbState
+from hive.db.bulk_loader import BulkLoader
 
 from hive.indexer.accounts import Accounts
 from hive.indexer.posts import Posts
@@ -55,6 +56,9 @@ class CustomOp:
                 cls._process_legacy(account, op_json, block_date)
             elif op['id'] == 'community':
                 if block_num > START_BLOCK:
+                    if BulkLoader.is_active():
+                        # community ops read and update hive_posts directly
+                        BulkLoader.flush()
                     process_json_community_op(account, op_json, block_date, block_num)
             elif op['id'] == 'notify':
                 cls._process_notify(account, op_json, block_date)
@@ -138,6 +142,9 @@ class CustomOp:
                 FeedCache.delete(post_id, blogger_id)
 
         else:
+            if (BulkLoader.pending('hive_posts', post_id)
+                    or BulkLoader.pending('hive_accounts', blogger)):
+                BulkLoader.flush() # hive_reblogs references posts, accounts
             sql = ("INSERT INTO hive_reblogs (account, post_id, created_at) "
                    "VALUES (:a, :pid, :date) ON CONFLICT (account, post_id) DO NOTHING")
             DB.query(sql, a=blogger, pid=post_id, date=block_date)
@@ -1,14 +1,19 @@
 """Handles follow operations."""
 
 import logging
+import collections
 from time import perf_counter as perf
 
 from funcy.seqs import first
+from toolz import partition_all
 from hive.db.adapter import Db
 from hive.db.db_state import DbState
+from hive.db.bulk_loader import BulkLoader
 from hive.indexer.accounts import Accounts
 from hive.indexer.notify import Notify
 
+# pylint: disable=too-many-lines
+
 log = logging.getLogger(__name__)
 
 DB = Db.instance()
@@ -29,6 +34,13 @@ def _flip_dict(dict_to_flip):
 class Follow:
     """Handles processing of incoming follow ups and flushing to db."""
 
+    # LRU cache for (follower, following) -> state; None if no row
+    CACHE_SIZE = 200000
+    _states = collections.OrderedDict()
+
+    # initial sync: states pending upsert {(flr, flg): [state, created_at]}
+    _upserts = {}
+
     @classmethod
     def follow_op(cls, account, op_json, date):
         """Process an incoming follow op."""
@@ -36,20 +48,26 @@ class Follow:
         if not op:
             return
 
+        # initial sync: no delta tracking; defer write to chunk end
+        if BulkLoader.is_active():
+            cls._buffer_upsert(op)
+            return
+
         # perform delta check
         new_state = op['state']
-        old_state = cls._get_follow_db_state(op['flr'], op['flg'])
+        old_state = cls._get_follow_state(op['flr'], op['flg'])
         if new_state == (old_state or 0):
             return
 
         # insert or update state
-        if old_state is None:
-            sql = """INSERT INTO hive_follows (follower, following,
-                     created_at, state) VALUES (:flr, :flg, :at, :state)"""
-        else:
+        if old_state is not None:
             sql = """UPDATE hive_follows SET state = :state
                       WHERE follower = :flr AND following = :flg"""
+        else:
+            sql = """INSERT INTO hive_follows (follower, following,
+                     created_at, state) VALUES (:flr, :flg, :at, :state)"""
         DB.query(sql, **op)
+        cls._cache_state(op['flr'], op['flg'], new_state)
 
         # track count deltas
         if not DbState.is_initial_sync():
@@ -87,6 +105,33 @@ class Follow:
                     state=defs[what],
                     at=date)
 
+    @classmethod
+    def _get_follow_state(cls, follower, following):
+        """Retrieve current follow state of an account pair (cached)."""
+        key = (follower, following)
+        if key in cls._states:
+            cls._states.move_to_end(key)
+            return cls._states[key]
+        state = cls._get_follow_db_state(follower, following)
+        cls._cache_state(follower, following, state)
+        return state
+
+    @classmethod
+    def _cache_state(cls, follower, following, state):
+        """Add an entry to the state LRU, maintaining max size."""
+        key = (follower, following)
+        cls._states[key] = state
+        cls._states.move_to_end(key)
+        if len(cls._states) > cls.CACHE_SIZE:
+            cls._states.popitem(last=False)
+
+    @classmethod
+    def clear_cache(cls):
+        """Drop cached states and pending writes, e.g. after a rewind."""
+        cls._states = collections.OrderedDict()
+        cls._upserts = {}
+        cls._delta = {FOLLOWERS: {}, FOLLOWING: {}}
+
     @classmethod
     def _get_follow_db_state(cls, follower, following):
         """Retrieve current follow state of an account pair."""
@@ -95,6 +140,67 @@ class Follow:
                     AND following = :following"""
         return DB.query_one(sql, follower=follower, following=following)
 
+    @classmethod
+    def _buffer_upsert(cls, op):
+        """Record the latest state of a pair, to be written blindly.
+
+        `created_at` is the date of the first op in the batch which
+        would create the row (i.e. non-zero state), if any.
+        """
+        key = (op['flr'], op['flg'])
+        if key not in cls._upserts:
+            cls._upserts[key] = [op['state'], None]
+        entry = cls._upserts[key]
+        entry[0] = op['state']
+        if entry[1] is None and op['state']:
+            entry[1] = op['at']
+
+    @classmethod
+    def flush_upserts(cls):
+        """Write buffered initial-sync follow states without reading.
+
+        Pairs which saw a non-zero state are upserted (an existing row
+        only has its state updated); pairs only ever reset to 0 need
+        no row, so they are applied as a plain update.
+        """
+        if not cls._upserts:
+            return 0
+
+        upserts, resets = [], []
+        for (flr, flg), (state, created_at) in cls._upserts.items():
+            if created_at:
+                upserts.append((flr, flg, state, created_at))
+            else:
+                resets.append((flr, flg))
+
+        for batch in partition_all(1000, upserts):
+            params, values = {}, []
+            for idx, row in enumerate(batch):
+                values.append("(:flr_%d, :flg_%d, :state_%d, :at_%d)"
+                              % (idx, idx, idx, idx))
+                params.update({'flr_%d' % idx: row[0], 'flg_%d' % idx: row[1],
+                               'state_%d' % idx: row[2], 'at_%d' % idx: row[3]})
+            sql = """INSERT INTO hive_follows (follower, following, state, created_at)
+                          VALUES %s
+                     ON CONFLICT (following, follower)
+                       DO UPDATE SET state = EXCLUDED.state"""
+            DB.query(sql % ', '.join(values), **params)
+
+        for batch in partition_all(1000, resets):
+            params, values = {}, []
+            for idx, (flr, flg) in enumerate(batch):
+                values.append("(:flr_%d, :flg_%d)" % (idx, idx))
+                params.update({'flr_%d' % idx: flr, 'flg_%d' % idx: flg})
+            sql = """UPDATE hive_follows SET state = 0
+                       FROM (VALUES %s) AS v (follower, following)
+                      WHERE hive_follows.follower = v.follower
+                        AND hive_follows.following = v.following"""
+            DB.query(sql % ', '.join(values), **params)
+
+        count = len(cls._upserts)
+        cls._upserts = {}
+        return count
+
 
     # -- stat tracking --
 
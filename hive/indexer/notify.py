@@ -2,6 +2,7 @@
 
 from enum import IntEnum
 import logging
+from toolz import partition_all
 from hive.db.adapter import Db
 #pylint: disable=too-many-lines,line-too-long
 
@@ -43,10 +44,18 @@ class NotifyType(IntEnum):
     #message = 25
 
 class Notify:
-    """Handles writing notifications/messages."""
+    """Handles writing notifications/messages.
+
+    Written notifications are buffered, and inserted in bulk by
+    `flush`, which must be called before the surrounding transaction
+    commits (see `Blocks.process_multi`, `Sync.listen`).
+    """
     # pylint: disable=too-many-instance-attributes,too-many-arguments
     DEFAULT_SCORE = 35
 
+    # rows pending insert
+    _queue = []
+
     def __init__(self, type_id, when=None, src_id=None, dst_id=None, community_id=None,
                  post_id=None, payload=None, score=None, **kwargs):
         """Create a notification."""
@@ -94,7 +103,7 @@ class Notify:
             id=self._id)
 
     def write(self):
-        """Store this notification."""
+        """Queue this notification for insert."""
         assert not self._id, 'notify has id %d' % self._id
         ignore = ('reply', 'reply_comment', 'reblog', 'follow', 'mention', 'vote')
         if self.enum.name not in ignore:
@@ -102,9 +111,38 @@ class Notify:
                         self.enum.name, self.src_id, self.dst_id, self.post_id,
                         ' (%s)' % self.payload if self.payload else '',
                         self.community_id, self.score)
-        sql = """INSERT INTO hive_notifs (type_id, score, created_at, src_id,
-                                          dst_id, post_id, community_id,
-                                          payload)
-                      VALUES (:type_id, :score, :created_at, :src_id, :dst_id,
-                              :post_id, :community_id, :payload)"""
-        DB.query(sql, **self.to_dict())
+        row = self.to_dict()
+        del row['id']
+        Notify._queue.append(row)
+
+    @classmethod
+    def is_pending(cls, **fields):
+        """Check if a queued notification matches all given fields."""
+        return any(all(row[key] == val for key, val in fields.items())
+                   for row in cls._queue)
+
+    @classmethod
+    def flush(cls):
+        """Insert all queued notifications. Returns count."""
+        if not cls._queue:
+            return 0
+
+        cols = ('type_id', 'score', 'created_at', 'src_id', 'dst_id',
+                'post_id', 'community_id', 'payload')
+        for batch in partition_all(1000, cls._queue):
+            params, values = {}, []
+            for idx, row in enumerate(batch):
+                values.append("(%s)" % ', '.join(
+                    ":%s_%d" % (col, idx) for col in cols))
+                params.update({"%s_%d" % (col, idx): row[col] for col in cols})
+            sql = """INSERT INTO hive_notifs (%s) VALUES %s"""
+            DB.query(sql % (', '.join(cols), ', '.join(values)), **params)
+
+        count = len(cls._queue)
+        cls._queue = []
+        return count
+
+    @classmethod
+    def clear(cls):
+        """Discard queued notifications, e.g. after a rollback."""
+        cls._queue = []
@@ -4,6 +4,7 @@ import logging
 
 from hive.db.adapter import Db
 from hive.db.db_state import DbState
+from hive.db.bulk_loader import BulkLoader
 from hive.utils.normalize import parse_amount
 
 from hive.indexer.posts import Posts
@@ -28,17 +29,26 @@ class Payments:
             return
 
         # add payment record
-        sql = DB.build_insert('hive_payments', record, pk='id')
-        DB.query(sql)
-
-        # read current amount
-        sql = "SELECT promoted FROM hive_posts WHERE id = :id"
-        curr_amount = DB.query_one(sql, id=record['post_id'])
-        new_amount = curr_amount + record['amount']
-
-        # update post record
-        sql = "UPDATE hive_posts SET promoted = :val WHERE id = :id"
-        DB.query(sql, val=new_amount, id=record['post_id'])
+        if BulkLoader.is_active():
+            BulkLoader.add('hive_payments', record)
+        else:
+            sql = DB.build_insert('hive_payments', record, pk='id')
+            DB.query(sql)
+
+        pending = BulkLoader.pending('hive_posts', record['post_id'])
+        if pending:
+            # post not written yet; apply to buffered row
+            pending['promoted'] += record['amount']
+            new_amount = pending['promoted']
+        else:
+            # read current amount
+            sql = "SELECT promoted FROM hive_posts WHERE id = :id"
+            curr_amount = DB.query_one(sql, id=record['post_id'])
+            new_amount = curr_amount + record['amount']
+
+            # update post record
+            sql = "UPDATE hive_posts SET promoted = :val WHERE id = :id"
+            DB.query(sql, val=new_amount, id=record['post_id'])
 
         # notify cached_post of new promoted balance, and trigger update
         if not DbState.is_initial_sync():
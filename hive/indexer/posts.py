@@ -5,12 +5,16 @@ import collections
 
 from hive.db.adapter import Db
 from hive.db.db_state import DbState
+from hive.db.bulk_loader import BulkLoader
 
 from hive.indexer.accounts import Accounts
 from hive.indexer.cached_post import CachedPost
 from hive.indexer.feed_cache import FeedCache
 from hive.indexer.community import Community, START_DATE
 from hive.indexer.notify import Notify
+from hive.utils.id_cache import IdCache
+
+# pylint: disable=too-many-lines
 
 log = logging.getLogger(__name__)
 DB = Db.instance()
@@ -18,26 +22,36 @@ DB = Db.instance()
 class Posts:
     """Handles critical/core post ops and data."""
 
-    # LRU cache for (author-permlink -> id) lookup (~400mb per 1M entries)
+    # CLOCK cache for (author-permlink -> id) lookup (~55mb at 2M entries)
     CACHE_SIZE = 2000000
-    _ids = collections.OrderedDict()
+    _ids = IdCache(CACHE_SIZE)
     _hits = 0
     _miss = 0
 
+    # new posts pending insert {url: (op, post)}
+    _inserts = collections.OrderedDict()
+
     @classmethod
     def last_id(cls):
         """Get the last indexed post id."""
         sql = "SELECT MAX(id) FROM hive_posts WHERE is_deleted = '0'"
         return DB.query_one(sql) or 0
 
+    @classmethod
+    def clear_ids(cls):
+        """Wipe id cache and pending inserts, e.g. after a rewind."""
+        cls._ids = IdCache(cls.CACHE_SIZE)
+        cls._inserts = collections.OrderedDict()
+
     @classmethod
     def get_id(cls, author, permlink):
-        """Look up id by author/permlink, making use of LRU cache."""
+        """Look up id by author/permlink, making use of id cache."""
         url = author+'/'+permlink
-        if url in cls._ids:
+        if url in cls._inserts:
+            cls.flush_inserts()
+        _id = cls._ids.get(url)
+        if _id:
             cls._hits += 1
-            _id = cls._ids.pop(url)
-            cls._ids[url] = _id
         else:
             cls._miss += 1
             sql = """SELECT id FROM hive_posts WHERE
@@ -49,18 +63,17 @@ class Posts:
         # cache stats (under 10M every 10K else every 100K)
         total = cls._hits + cls._miss
         if total % 100000 == 0:
-            log.info("pid lookups: %d, hits: %d (%.1f%%), entries: %d",
-                     total, cls._hits, 100.0*cls._hits/total, len(cls._ids))
+            log.info("pid lookups: %d, hits: %d (%.1f%%), entries: %d (%dmb)",
+                     total, cls._hits, 100.0*cls._hits/total, len(cls._ids),
+                     cls._ids.nbytes() // 1024**2)
 
         return _id
 
     @classmethod
     def _set_id(cls, url, pid):
-        """Add an entry to the LRU, maintaining max size."""
+        """Add an entry to the id cache; evicts if at max size."""
         assert pid, "no pid provided for %s" % url
-        if len(cls._ids) > cls.CACHE_SIZE:
-            cls._ids.popitem(last=False)
-        cls._ids[url] = pid
+        cls._ids.set(url, pid)
 
     @classmethod
     def save_ids_from_tuples(cls, tuples):
@@ -78,12 +91,18 @@ class Posts:
         _id = cls.get_id(author, permlink)
         if not _id:
             return (None, -1)
+        pending = BulkLoader.pending('hive_posts', _id)
+        if pending:
+            return (_id, pending['depth'])
         depth = DB.query_one("SELECT depth FROM hive_posts WHERE id = :id", id=_id)
         return (_id, depth)
 
     @classmethod
     def is_pid_deleted(cls, pid):
         """Check if the state of post is deleted."""
+        pending = BulkLoader.pending('hive_posts', pid)
+        if pending:
+            return pending['is_deleted']
         sql = "SELECT is_deleted FROM hive_posts WHERE id = :id"
         return DB.query_one(sql, id=pid)
 
@@ -111,27 +130,85 @@ class Posts:
 
     @classmethod
     def insert(cls, op, date):
-        """Inserts new post records."""
+        """Inserts new post records.
+
+        During initial sync rows go to `BulkLoader`. Otherwise, new
+        posts are queued and written together by `flush_inserts`.
+        """
+        post = cls._build_post(op, date)
+        url = op['author']+'/'+op['permlink']
+        if BulkLoader.is_active():
+            post['id'] = cls._buffer_insert(post)
+            cls._set_id(url, post['id'])
+        else:
+            cls._inserts[url] = (op, post)
+
+    @classmethod
+    def flush_inserts(cls):
+        """Write queued new posts using a single multi-row insert.
+
+        Called at the end of each block, and whenever the id of a
+        queued post is requested. Returns number of posts written.
+        """
+        if not cls._inserts:
+            return 0
+        queued = list(cls._inserts.values())
+        cls._inserts = collections.OrderedDict()
+
+        cols = ['is_valid', 'is_muted', 'parent_id', 'author', 'permlink',
+                'category', 'community_id', 'depth', 'date']
+        params = {}
+        values = []
+        for idx, (_, post) in enumerate(queued):
+            keys = ["%s_%d" % (col, idx) for col in cols]
+            params.update(zip(keys, [post[col] for col in cols]))
+            values.append("(:%s)" % ", :".join(keys))
+
         sql = """INSERT INTO hive_posts (is_valid, is_muted, parent_id, author,
                              permlink, category, community_id, depth, created_at)
-                      VALUES (:is_valid, :is_muted, :parent_id, :author,
-                             :permlink, :category, :community_id, :depth, :date)"""
-        sql += ";SELECT currval(pg_get_serial_sequence('hive_posts','id'))"
-        post = cls._build_post(op, date)
-        result = DB.query(sql, **post)
-        post['id'] = int(list(result)[0][0])
-        cls._set_id(op['author']+'/'+op['permlink'], post['id'])
+                      VALUES %s RETURNING id, author, permlink"""
+        result = DB.query(sql % ', '.join(values), **params)
+        ids = {author+'/'+permlink: pid for pid, author, permlink in result}
+
+        for op, post in queued:
+            url = op['author']+'/'+op['permlink']
+            post['id'] = ids[url]
+            cls._set_id(url, post['id'])
+            if not DbState.is_initial_sync():
+                cls._after_insert(op, post)
+        return len(queued)
 
-        if not DbState.is_initial_sync():
-            if post['error']:
-                author_id = Accounts.get_id(post['author'])
-                Notify('error', dst_id=author_id, when=date,
-                       post_id=post['id'], payload=post['error']).write()
-            CachedPost.insert(op['author'], op['permlink'], post['id'])
-            if op['parent_author']: # update parent's child count
-                CachedPost.recount(op['parent_author'],
-                                   op['parent_permlink'], post['parent_id'])
-            cls._insert_feed_cache(post)
+    @classmethod
+    def _after_insert(cls, op, post):
+        """Queue cache/feed updates and notifs for a new post."""
+        if post['error']:
+            author_id = Accounts.get_id(post['author'])
+            Notify('error', dst_id=author_id, when=post['date'],
+                   post_id=post['id'], payload=post['error']).write()
+        CachedPost.insert(op['author'], op['permlink'], post['id'])
+        if op['parent_author']: # update parent's child count
+            CachedPost.recount(op['parent_author'],
+                               op['parent_permlink'], post['parent_id'])
+        cls._insert_feed_cache(post)
+
+    @classmethod
+    def _buffer_insert(cls, post):
+        """Buffer a new post row in `BulkLoader`, allocating its id."""
+        pid = BulkLoader.next_id('hive_posts')
+        BulkLoader.add('hive_posts', {
+            'id': pid,
+            'parent_id': post['parent_id'],
+            'author': post['author'],
+            'permlink': post['permlink'],
+            'category': post['category'],
+            'community_id': post['community_id'],
+            'created_at': post['date'],
+            'depth': post['depth'],
+            'is_deleted': False,
+            'is_muted': post['is_muted'],
+            'is_valid': post['is_valid'],
+            'promoted': 0}, key=pid)
+        return pid
 
     @classmethod
     def undelete(cls, op, date, pid):
@@ -142,7 +219,13 @@ class Posts:
                    community_id = :community_id, depth = :depth
                  WHERE id = :id"""
         post = cls._build_post(op, date, pid)
-        DB.query(sql, **post)
+        pending = BulkLoader.pending('hive_posts', pid)
+        if pending:
+            pending.update(is_deleted=False, **{key: post[key] for key in (
+                'is_valid', 'is_muted', 'parent_id', 'category',
+                'community_id', 'depth')})
+        else:
+            DB.query(sql, **post)
 
         if not DbState.is_initial_sync():
             if post['error']:
@@ -158,7 +241,11 @@ class Posts:
     def delete(cls, op):
         """Marks a post record as being deleted."""
         pid, depth = cls.get_id_and_depth(op['author'], op['permlink'])
-        DB.query("UPDATE hive_posts SET is_deleted = '1' WHERE id = :id", id=pid)
+        pending = BulkLoader.pending('hive_posts', pid)
+        if pending:
+            pending['is_deleted'] = True
+        else:
+            DB.query("UPDATE hive_posts SET is_deleted = '1' WHERE id = :id", id=pid)
 
         if not DbState.is_initial_sync():
             CachedPost.delete(pid, op['author'], op['permlink'])
@@ -226,10 +313,16 @@ class Posts:
         # this is a comment; inherit parent props.
         else:
             parent_id = cls.get_id(op['parent_author'], op['parent_permlink'])
-            sql = """SELECT depth, category, community_id, is_valid, is_muted
-                       FROM hive_posts WHERE id = :id"""
-            (parent_depth, category, community_id, is_valid,
-             is_muted) = DB.query_row(sql, id=parent_id)
+            pending = BulkLoader.pending('hive_posts', parent_id)
+            if pending:
+                (parent_depth, category, community_id, is_valid,
+                 is_muted) = (pending[key] for key in (
+                     'depth', 'category', 'community_id', 'is_valid', 'is_muted'))
+            else:
+                sql = """SELECT depth, category, community_id, is_valid, is_muted
+                           FROM hive_posts WHERE id = :id"""
+                (parent_depth, category, community_id, is_valid,
+                 is_muted) = DB.query_row(sql, id=parent_id)
             depth = parent_depth + 1
             if not is_valid: error = 'replying to invalid post'
             elif is_muted: error = 'replying to muted post'
@@ -1,17 +1,13 @@
 """Hive sync manager."""
 
 import logging
-import glob
 from time import perf_counter as perf
-import os
 import ujson as json
 
-from funcy.seqs import drop
-from toolz import partition_all
-
 from hive.db.db_state import DbState
 
 from hive.utils.timer import Timer
+from hive.utils.prefetch import Prefetch
 from hive.steem.block.stream import MicroForkException
 
 from hive.indexer.blocks import Blocks
@@ -20,11 +16,20 @@ from hive.indexer.cached_post import CachedPost
 from hive.indexer.feed_cache import FeedCache
 from hive.indexer.follow import Follow
 from hive.indexer.community import Community
+from hive.indexer.notify import Notify
+from hive.indexer.checkpoints import CheckpointReader, list_checkpoints
 
 #from hive.indexer.jobs import audit_cache_missing, audit_cache_deleted
 
 log = logging.getLogger(__name__)
 
+def _fetch_chunks(steemd, lbound, ubound, chunk_size):
+    """Yields consecutive chunks of blocks in the range [lbound, ubound)."""
+    while lbound < ubound:
+        to = min(lbound + chunk_size, ubound)
+        yield steemd.get_blocks_range(lbound, to)
+        lbound = to
+
 class Sync:
     """Manages the sync/index process.
 
@@ -103,34 +108,36 @@ class Sync:
     def from_checkpoints(self, chunk_size=1000):
         """Initial sync strategy: read from blocks on disk.
 
-        This methods scans for files matching ./checkpoints/*.json.lst
-        and uses them for hive's initial sync. Each line must contain
-        exactly one block in JSON format.
+        This methods scans for checkpoint files in ./checkpoints/ and
+        uses them for hive's initial sync. Files are either JSON-lines
+        (`*.json.lst`, one block per line) or packed (`*.json.z`, see
+        `hive.indexer.checkpoints`). Packed files are seeked directly
+        to the resume point.
+
+        With `checkpoint_workers` > 0, JSON decoding is spread across
+        a process pool while this process does the indexing.
         """
-        # pylint: disable=no-self-use
         last_block = Blocks.head_num()
-
-        tuplize = lambda path: [int(path.split('/')[-1].split('.')[0]), path]
-        basedir = os.path.dirname(os.path.realpath(__file__ + "/../.."))
-        files = glob.glob(basedir + "/checkpoints/*.json.lst")
-        tuples = sorted(map(tuplize, files), key=lambda f: f[0])
+        workers = self._conf.get('checkpoint_workers')
 
         last_read = 0
-        for (num, path) in tuples:
-            if last_block < num:
-                log.info("[SYNC] Load %s. Last block: %d", path, last_block)
-                with open(path) as f:
-                    # each line in file represents one block
+        with CheckpointReader(workers, chunk_size) as reader:
+            for (num, path) in list_checkpoints():
+                if last_block < num:
+                    log.info("[SYNC] Load %s. Last block: %d", path, last_block)
                     # we can skip the blocks we already have
                     skip_lines = last_block - last_read
-                    remaining = drop(skip_lines, f)
-                    for lines in partition_all(chunk_size, remaining):
-                        Blocks.process_multi(map(json.loads, lines), True)
-                last_block = num
-            last_read = num
+                    for blocks in reader.read(path, skip_lines):
+                        Blocks.process_multi(blocks, True)
+                    last_block = num
+                last_read = num
 
     def from_steemd(self, is_initial_sync=False, chunk_size=1000):
-        """Fast sync strategy: read/process blocks in batches."""
+        """Fast sync strategy: read/process blocks in batches.
+
+        With `sync_prefetch` > 0, upcoming chunks are fetched on a
+        background thread while the current chunk is being indexed.
+        """
         steemd = self._steem
         lbound = Blocks.head_num() + 1
         ubound = self._conf.get('test_max_block') or steemd.last_irreversible()
@@ -139,24 +146,35 @@ class Sync:
         if count < 1:
             return
 
+        depth = self._conf.get('sync_prefetch')
+        chunks = _fetch_chunks(steemd, lbound, ubound, chunk_size)
+        queue = Prefetch(chunks, depth) if depth else None
+
         log.info("[SYNC] start block %d, +%d to sync", lbound, count)
         timer = Timer(count, entity='block', laps=['rps', 'wps'])
-        while lbound < ubound:
-            timer.batch_start()
-
-            # fetch blocks
-            to = min(lbound + chunk_size, ubound)
-            blocks = steemd.get_blocks_range(lbound, to)
-            lbound = to
-            timer.batch_lap()
-
-            # process blocks
-            Blocks.process_multi(blocks, is_initial_sync)
-            timer.batch_finish(len(blocks))
-
-            _prefix = ("[SYNC] Got block %d @ %s" % (
-                to - 1, blocks[-1]['timestamp']))
-            log.info(timer.batch_status(_prefix))
+        try:
+            while True:
+                timer.batch_start()
+
+                # fetch blocks (or wait for prefetched chunk)
+                blocks = next(queue or chunks, None)
+                if not blocks:
+                    break
+                timer.batch_lap()
+
+                # process blocks
+                Blocks.process_multi(blocks, is_initial_sync)
+                timer.batch_finish(len(blocks))
+
+                num = int(blocks[-1]['block_id'][:8], base=16)
+                _prefix = ("[SYNC] Got block %d @ %s" % (
+                    num, blocks[-1]['timestamp']))
+                if queue:
+                    _prefix += " [q %d/%d]" % (queue.size(), depth)
+                log.info(timer.batch_status(_prefix))
+        finally:
+            if queue:
+                queue.close()
 
         if not is_initial_sync:
             # This flush is low importance; accounts are swept regularly.
@@ -180,7 +198,9 @@ class Sync:
         steemd = self._steem
         hive_head = Blocks.head_num()
 
-        for block in steemd.stream_blocks(hive_head + 1, trail_blocks, max_gap):
+        prefetch = self._conf.get('listen_prefetch')
+        for block in steemd.stream_blocks(hive_head + 1, trail_blocks, max_gap,
+                                          prefetch):
             start_time = perf()
 
             self._db.query("START TRANSACTION")
@@ -189,6 +209,7 @@ class Sync:
             accts = Accounts.flush(steemd, trx=False, spread=8)
             CachedPost.dirty_paidouts(block['timestamp'])
             cnt = CachedPost.flush(steemd, trx=False)
+            Notify.flush()
             self._db.query("COMMIT")
 
             ms = (perf() - start_time) * 1000
@@ -201,15 +222,16 @@ class Sync:
             if num % 1200 == 0: #1hr
                 log.warning("head block %d @ %s", num, block['timestamp'])
                 log.info("[LIVE] hourly stats")
-                Accounts.fetch_ranks()
-                #Community.recalc_pending_payouts()
-            if num % 200 == 0: #10min
                 Community.recalc_pending_payouts()
+            elif num % 200 == 0: #10min
+                Community.recalc_pending_payouts(full=False)
             if num % 100 == 0: #5min
                 log.info("[LIVE] 5-min stats")
+                log.info("[LIVE] post cache queue: %s", CachedPost.queue_depths())
                 Accounts.dirty_oldest(500)
             if num % 20 == 0: #1min
                 self._update_chain_state()
+                Blocks.prune_undo(steemd.last_irreversible())
 
     # refetch dynamic_global_properties, feed price, etc
     def _update_chain_state(self):
@@ -3,6 +3,7 @@
 import logging
 from time import sleep
 from hive.steem.block.schedule import BlockSchedule
+from hive.utils.prefetch import Prefetch
 
 log = logging.getLogger(__name__)
 
@@ -52,11 +53,24 @@ class BlockQueue:
 class BlockStream:
     """ETA-based block streamer."""
 
+    # fetch blocks in ranged batches when more than this many behind
+    CATCHUP_GAP = 5
+
+    # max blocks per ranged batch
+    CATCHUP_BATCH = 500
+
     @classmethod
-    def stream(cls, client, start_block, min_gap=0, max_gap=100):
-        """Instantiates a BlockStream and returns a generator."""
+    def stream(cls, client, start_block, min_gap=0, max_gap=100, prefetch=2):
+        """Instantiates a BlockStream and returns a generator.
+
+        If `prefetch` > 0, blocks are fetched (and fork-checked) on a
+        background thread up to that many blocks ahead of the consumer,
+        so that fetching overlaps with processing.
+        """
         streamer = BlockStream(client, min_gap, max_gap)
-        return streamer.start(start_block)
+        if not prefetch:
+            return streamer.start(start_block)
+        return streamer.prefetch(start_block, prefetch)
 
     def __init__(self, client, min_gap=0, max_gap=100):
         assert not (min_gap < 0 or min_gap > 100)
@@ -68,6 +82,15 @@ class BlockStream:
         """Ensures gap between curr and head is within limits (max_gap)."""
         return not self._max_gap or head - curr < self._max_gap
 
+    def prefetch(self, start_block, depth):
+        """Run `start` on a background thread; yield its blocks in order.
+
+        Exceptions raised by the stream (e.g. a fork) are re-raised
+        once the blocks preceding them have been consumed.
+        """
+        with Prefetch(self.start(start_block), depth) as blocks:
+            yield from blocks
+
     def start(self, start_block):
         """Stream blocks starting from `start_block`.
 
@@ -82,6 +105,19 @@ class BlockStream:
 
         while self._gap_ok(curr, head):
             head = schedule.wait_for_block(curr)
+
+            # catching up: fetch blocks up to confirmed head in bulk
+            if head - curr > self.CATCHUP_GAP:
+                blocks = self._catchup(curr, head)
+                for block in blocks:
+                    schedule.check_block(curr, block)
+                    popped = queue.push(block)
+                    if popped:
+                        yield popped
+                    curr += 1
+                if blocks:
+                    continue
+
             block = self._client.get_block(curr, strict=False)
             schedule.check_block(curr, block)
 
@@ -96,3 +132,18 @@ class BlockStream:
             curr += 1
 
         log.warning("gap exceeds %d", self._max_gap)
+
+    def _catchup(self, curr, head):
+        """Fetch a batch of blocks from `curr`, up to the chain's head.
+
+        The schedule's head is an estimate which may run several blocks
+        ahead of the chain (e.g. when witnesses miss slots), so the
+        batch is capped at the node's reported head block. Returns an
+        empty list if there is nothing to fetch in bulk."""
+        head = min(head, self._client.head_block())
+        ubound = min(head + 1, curr + self.CATCHUP_BATCH)
+        if ubound <= curr:
+            return []
+        log.info("catching up: fetching blocks %d - %d (head %d)",
+                 curr, ubound - 1, head)
+        return self._client.get_blocks_range(curr, ubound)
@@ -29,6 +29,32 @@ class SteemClient:
                                            % (len(accounts), len(ret)))
         return ret
 
+    def get_accounts_multi(self, batches):
+        """Fetch batches of accounts (up to 1000 names each) in parallel.
+
+        Yields each batch's accounts in request order. Up to
+        `max_workers` requests are made at once, and at most twice
+        that many batches are fetched ahead of the consumer.
+        """
+        batches = list(batches)
+        if len(batches) == 1 or self._max_workers == 1:
+            for names in batches:
+                yield self.get_accounts(names)
+            return
+
+        start = perf()
+        params = ([names] for names in batches)
+        results = self._client.exec_multi_ordered(
+            'get_accounts', params,
+            max_workers=self._max_workers,
+            ahead=2 * self._max_workers)
+        for names, ret in zip(batches, results):
+            assert len(names) == len(ret), ("requested %d accounts got %d"
+                                            % (len(names), len(ret)))
+            yield ret
+        Stats.log_steem('get_accounts', perf() - start,
+                        sum(len(names) for names in batches))
+
     def get_all_account_names(self):
         """Fetch all account names."""
         ret = []
@@ -60,9 +86,11 @@ class SteemClient:
         else:
             return None
 
-    def stream_blocks(self, start_from, trail_blocks=0, max_gap=100):
+    def stream_blocks(self, start_from, trail_blocks=0, max_gap=100,
+                      prefetch=2):
         """Stream blocks. Returns a generator."""
-        return BlockStream.stream(self, start_from, trail_blocks, max_gap)
+        return BlockStream.stream(self, start_from, trail_blocks, max_gap,
+                                  prefetch)
 
     def _gdgp(self):
         ret = self.__exec('get_dynamic_global_properties')
@@ -1,6 +1,7 @@
 # coding=utf-8
 """Simple HTTP client for communicating with jussi/steem."""
 
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
 import socket
@@ -190,6 +191,20 @@ class HttpClient(object):
             for items in executor.map(lambda tup: self.exec(*tup), chunks):
                 yield list(items) # (use of `map` preserves request order)
 
+    def exec_multi_ordered(self, name, params, max_workers, ahead):
+        """Process single calls as parallel requests; yields in order.
+
+        At most `ahead` calls are in flight or buffered beyond the one
+        being consumed, so `params` may be a lazy or long iterable."""
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = deque()
+            for args in params:
+                futures.append(executor.submit(self.exec, name, args))
+                if len(futures) > ahead:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+
     def exec_multi_as_completed(self, name, params, max_workers, batch_size):
         """Process a batch as parallel requests; yields unordered."""
         chunks = [[name, args, True] for args in chunkify(params, batch_size)]
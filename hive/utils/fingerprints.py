@@ -0,0 +1,41 @@
+"""Compact fingerprints of written values, for skipping unchanged writes."""
+
+from hashlib import blake2b
+from hive.utils.id_cache import IdCache
+
+def fingerprint(values):
+    """64-bit hash of a list of `(column, value)` pairs; never 0."""
+    digest = blake2b(repr(values).encode('utf8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+class Fingerprints:
+    """Remembers a fingerprint of the values last written to each
+    (row, column group), so that unchanged groups can be skipped.
+
+    Backed by a bounded `IdCache`: a group which was never seen, or
+    has been evicted or forgotten, is always reported as changed.
+    Fingerprints are 64-bit, so a change is only missed on a hash
+    collision (~5e-20 per write).
+    """
+
+    def __init__(self, capacity):
+        self._cache = IdCache(capacity, wide=True)
+
+    def changed(self, row, group, values):
+        """Check if `values` differ from those last recorded for the
+        row's group, recording them as the latest."""
+        key = '%s/%s' % (row, group)
+        digest = fingerprint(values)
+        if self._cache.get(key) == digest:
+            return False
+        self._cache.set(key, digest)
+        return True
+
+    def forget(self, row, groups):
+        """Drop recorded groups of a row, e.g. after it was deleted."""
+        for group in groups:
+            self._cache.remove('%s/%s' % (row, group))
+
+    def clear(self):
+        """Drop all recorded fingerprints."""
+        self._cache = IdCache(self._cache.capacity(), wide=True)
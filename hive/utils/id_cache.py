@@ -0,0 +1,133 @@
+"""Compact, bounded cache of string keys to integer ids."""
+
+from array import array
+from hashlib import blake2b
+
+def _hash(key):
+    """64-bit hash of a string key; never 0 (marks an empty slot)."""
+    digest = blake2b(key.encode('utf8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+class IdCache:
+    """Maps string keys to (positive, 32-bit) ids, evicting when full.
+
+    Keys are stored as 64-bit hashes in an open-addressing table with
+    linear probing, backed by flat arrays: each slot costs 13 bytes,
+    versus several hundred for an `OrderedDict` entry and its string.
+    With `wide`, values are 64-bit instead (17 bytes per slot).
+    Since only hashes are kept, two keys could in theory collide; at
+    a few million entries the odds are negligible (~1e-13 per lookup).
+
+    Eviction uses CLOCK, an approximation of LRU: lookups set a slot's
+    reference bit, and when full the eviction hand sweeps the table,
+    clearing bits until it finds a slot not used since its last pass.
+    """
+
+    LOAD_FACTOR = 0.7
+
+    def __init__(self, capacity, wide=False):
+        assert capacity > 0, "capacity must be positive"
+        size = 8
+        while size * self.LOAD_FACTOR < capacity:
+            size *= 2
+        self._capacity = capacity
+        self._mask = size - 1
+        self._keys = array('Q', bytes(8 * size))
+        typecode = 'Q' if wide else 'I'
+        self._vals = array(typecode, bytes(array(typecode).itemsize * size))
+        self._refs = bytearray(size)
+        self._count = 0
+        self._hand = 0
+
+    def _find(self, khash):
+        """Get the slot holding `khash`, or the empty slot ending its probe."""
+        keys, mask = self._keys, self._mask
+        idx = khash & mask
+        while keys[idx] and keys[idx] != khash:
+            idx = (idx + 1) & mask
+        return idx
+
+    def get(self, key):
+        """Get the id for `key`, or None. Marks the entry as used."""
+        khash = _hash(key)
+        idx = self._find(khash)
+        if self._keys[idx] != khash:
+            return None
+        self._refs[idx] = 1
+        return self._vals[idx]
+
+    def set(self, key, val):
+        """Insert or update `key`, evicting an entry if at capacity."""
+        assert val > 0, "ids must be positive"
+        khash = _hash(key)
+        idx = self._find(khash)
+        if self._keys[idx] != khash:
+            if self._count >= self._capacity:
+                self._evict()
+                idx = self._find(khash)
+            self._keys[idx] = khash
+            self._count += 1
+        self._vals[idx] = val
+        self._refs[idx] = 1
+
+    def remove(self, key):
+        """Remove `key` if present. Returns True if it was."""
+        khash = _hash(key)
+        idx = self._find(khash)
+        if self._keys[idx] != khash:
+            return False
+        self._delete(idx)
+        return True
+
+    def _evict(self):
+        """Advance the CLOCK hand until one entry has been removed."""
+        keys, refs, mask = self._keys, self._refs, self._mask
+        idx = self._hand
+        while True:
+            if keys[idx]:
+                if not refs[idx]:
+                    break
+                refs[idx] = 0
+            idx = (idx + 1) & mask
+        # an entry may be shifted into this slot; leave the hand on it
+        self._hand = idx
+        self._delete(idx)
+
+    def _delete(self, idx):
+        """Empty a slot, shifting back any entries displaced past it."""
+        keys, vals, refs, mask = self._keys, self._vals, self._refs, self._mask
+        keys[idx] = 0
+        nxt = idx
+        while True:
+            nxt = (nxt + 1) & mask
+            khash = keys[nxt]
+            if not khash:
+                break
+            home = khash & mask
+            # entry can stay if its home lies cyclically in (idx, nxt]
+            if idx <= nxt:
+                if idx < home <= nxt:
+                    continue
+            elif home > idx or home <= nxt:
+                continue
+            keys[idx], vals[idx], refs[idx] = khash, vals[nxt], refs[nxt]
+            keys[nxt] = 0
+            idx = nxt
+        self._count -= 1
+
+    def __contains__(self, key):
+        khash = _hash(key)
+        return self._keys[self._find(khash)] == khash
+
+    def __len__(self):
+        return self._count
+
+    def capacity(self):
+        """Max number of entries."""
+        return self._capacity
+
+    def nbytes(self):
+        """Memory used by the table's buffers, in bytes."""
+        return (len(self._keys) * self._keys.itemsize
+                + len(self._vals) * self._vals.itemsize
+                + len(self._refs))
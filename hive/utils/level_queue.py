@@ -0,0 +1,67 @@
+"""Deduplicating queue with one FIFO bucket per priority level."""
+
+from collections import OrderedDict
+
+class LevelQueue:
+    """Queue of unique keys, each at a priority level.
+
+    Levels are integers `0..levels-1`, with 0 the highest priority.
+    Each level has its own insertion-ordered bucket, so a level can be
+    drained without scanning the others. Re-adding a key at a higher
+    priority moves it to that level's bucket in O(1); adding it at a
+    lower priority is a no-op.
+    """
+
+    def __init__(self, levels):
+        assert levels > 0, "need at least one level"
+        self._buckets = [OrderedDict() for _ in range(levels)]
+        self._levels = {}
+
+    def add(self, key, level):
+        """Queue `key` at `level`, or promote it. Returns True if changed."""
+        curr = self._levels.get(key)
+        if curr is not None:
+            if curr <= level:
+                return False
+            del self._buckets[curr][key]
+        self._buckets[level][key] = None
+        self._levels[key] = level
+        return True
+
+    def remove(self, key):
+        """Remove `key` if queued. Returns True if it was."""
+        level = self._levels.pop(key, None)
+        if level is None:
+            return False
+        del self._buckets[level][key]
+        return True
+
+    def level(self, key):
+        """Get the level of a queued key, or None."""
+        return self._levels.get(key)
+
+    def take(self, level, count=None):
+        """Remove and return up to `count` oldest keys at `level`."""
+        bucket = self._buckets[level]
+        if count is None or count >= len(bucket):
+            keys = list(bucket)
+            self._buckets[level] = OrderedDict()
+        else:
+            keys = [bucket.popitem(last=False)[0] for _ in range(count)]
+        for key in keys:
+            del self._levels[key]
+        return keys
+
+    def depth(self, level):
+        """Number of keys queued at `level`."""
+        return len(self._buckets[level])
+
+    def depths(self):
+        """Number of keys queued, per level."""
+        return [len(bucket) for bucket in self._buckets]
+
+    def __contains__(self, key):
+        return key in self._levels
+
+    def __len__(self):
+        return len(self._levels)
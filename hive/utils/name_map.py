@@ -0,0 +1,148 @@
+"""Compact map of account names to ids."""
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+# steem account names are at most 16 characters
+WIDTH = 16
+
+# one fence key is kept per block of this many names
+BLOCK = 64
+
+def _key(name):
+    """Fixed-width, NUL-padded key; None if `name` does not fit."""
+    raw = name.encode('utf8')
+    if len(raw) > WIDTH:
+        return None
+    return raw.ljust(WIDTH, b'\0')
+
+class _Keys:
+    """Sequence view of the packed name table, for `bisect`."""
+
+    def __init__(self, names):
+        self._names = names
+
+    def __len__(self):
+        return len(self._names) // WIDTH
+
+    def __getitem__(self, idx):
+        return self._names[idx * WIDTH:(idx + 1) * WIDTH]
+
+class NameMap:
+    """Dict-like map of account names to (32-bit) ids.
+
+    Names are stored NUL-padded to `WIDTH` bytes in a single sorted
+    buffer, with ids in a parallel `array`. A lookup bisects a short
+    list of fence keys (the first key of each `BLOCK`), then scans
+    that block with `find`. This takes ~20 bytes per account versus
+    well over 100 for a `dict` of `str` to `int`.
+
+    New names are kept in a small side dict until it grows past a
+    fraction of the table, then spliced in. Names which do not fit
+    in `WIDTH` bytes are kept in the side dict.
+    """
+
+    # merge pending names once they reach this fraction of the table
+    MERGE_RATIO = 1 / 8
+    MIN_MERGE = 1000
+
+    def __init__(self):
+        self._names = bytearray()
+        self._ids = array('I')
+        self._fence = []
+        self._extra = {}
+        self._pending = 0
+
+    @classmethod
+    def from_sorted(cls, rows):
+        """Build from `(name, id)` rows ordered bytewise by name
+        (i.e. `ORDER BY name COLLATE "C"`)."""
+        obj = cls()
+        last = b''
+        for name, _id in rows:
+            key = _key(name)
+            if key is None:
+                obj._extra[name] = _id
+                continue
+            assert key > last, "names not sorted/unique at %s" % name
+            last = key
+            obj._names += key
+            obj._ids.append(_id)
+        obj._build_fence()
+        return obj
+
+    def _build_fence(self):
+        step = BLOCK * WIDTH
+        self._fence = [bytes(self._names[pos:pos + WIDTH])
+                       for pos in range(0, len(self._names), step)]
+
+    def _find(self, key):
+        """Get index of `key` in the table, or None."""
+        block = bisect_right(self._fence, key) - 1
+        if block < 0:
+            return None
+        pos = block * BLOCK * WIDTH
+        end = min(pos + BLOCK * WIDTH, len(self._names))
+        while True:
+            pos = self._names.find(key, pos, end)
+            if pos < 0:
+                return None
+            if not pos % WIDTH:
+                return pos // WIDTH
+            # matched across two entries; keep looking
+            pos += 1
+
+    def get(self, name, default=None):
+        """Get the id for `name`, or `default`."""
+        if name in self._extra:
+            return self._extra[name]
+        key = _key(name)
+        idx = self._find(key) if key else None
+        return default if idx is None else self._ids[idx]
+
+    def __getitem__(self, name):
+        _id = self.get(name)
+        if _id is None:
+            raise KeyError(name)
+        return _id
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __setitem__(self, name, _id):
+        """Add a new name. Existing names may not be remapped."""
+        assert name not in self, "name %s already mapped" % name
+        self._extra[name] = _id
+        if _key(name):
+            self._pending += 1
+        if self._pending >= max(self.MIN_MERGE,
+                                len(self._ids) * self.MERGE_RATIO):
+            self._merge()
+
+    def __len__(self):
+        return len(self._ids) + len(self._extra)
+
+    def _merge(self):
+        """Splice pending names into the sorted table."""
+        pending = sorted((_key(name), name) for name in self._extra
+                         if _key(name))
+        keys = _Keys(self._names)
+        names, ids = bytearray(), array('I')
+        start = 0
+        for key, name in pending:
+            idx = bisect_left(keys, key, start)
+            names += self._names[start * WIDTH:idx * WIDTH]
+            ids.extend(self._ids[start:idx])
+            names += key
+            ids.append(self._extra.pop(name))
+            start = idx
+        names += self._names[start * WIDTH:]
+        ids.extend(self._ids[start:])
+        self._names, self._ids = names, ids
+        self._build_fence()
+        self._pending = 0
+
+    def nbytes(self):
+        """Approximate memory used by the table, in bytes."""
+        return (len(self._names) + len(self._ids) * self._ids.itemsize
+                + 50 * len(self._fence) + 100 * len(self._extra))
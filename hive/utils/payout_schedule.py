@@ -0,0 +1,61 @@
+"""Compact time wheel of ids keyed by (unix) timestamp."""
+
+import heapq
+from array import array
+
+class PayoutSchedule:
+    """Schedules ids by timestamp; pops those which have come due.
+
+    Ids are kept in time buckets of `width` seconds, each holding two
+    flat arrays (id, offset within bucket), with a heap of bucket
+    keys. This costs ~6 bytes per entry. Popping only touches buckets
+    which are (at least partly) due.
+
+    Entries are never updated or removed in place: rescheduling an id
+    adds another entry, and callers must tolerate (and re-check) ids
+    which come due more than once or are no longer relevant.
+    """
+
+    def __init__(self, width=60):
+        assert 0 < width <= 65536, "invalid bucket width"
+        self._width = width
+        self._buckets = {}
+        self._keys = []
+        self._count = 0
+
+    def add(self, _id, when):
+        """Schedule `_id` at timestamp `when`."""
+        key, offset = divmod(int(when), self._width)
+        if key not in self._buckets:
+            self._buckets[key] = (array('I'), array('H'))
+            heapq.heappush(self._keys, key)
+        ids, offsets = self._buckets[key]
+        ids.append(_id)
+        offsets.append(offset)
+        self._count += 1
+
+    def pop_due(self, when):
+        """Remove and return ids (unique, sorted) due at or before `when`."""
+        key_now, offset_now = divmod(int(when), self._width)
+        due = set()
+        while self._keys and self._keys[0] <= key_now:
+            key = self._keys[0]
+            ids, offsets = self._buckets[key]
+            if key < key_now:
+                due.update(ids)
+                self._count -= len(ids)
+            else:
+                # current bucket: split into due and pending
+                keep = [(i, o) for i, o in zip(ids, offsets) if o > offset_now]
+                due.update(i for i, o in zip(ids, offsets) if o <= offset_now)
+                self._count -= len(ids) - len(keep)
+                if keep:
+                    self._buckets[key] = (array('I', (i for i, _ in keep)),
+                                          array('H', (o for _, o in keep)))
+                    break
+            del self._buckets[key]
+            heapq.heappop(self._keys)
+        return sorted(due)
+
+    def __len__(self):
+        return self._count
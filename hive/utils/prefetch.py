@@ -0,0 +1,100 @@
+"""Bounded background prefetching for slow (I/O-bound) iterators."""
+
+import logging
+import threading
+from queue import Queue, Empty, Full
+
+log = logging.getLogger(__name__)
+
+_DONE = object()
+
+class Prefetch:
+    """Iterates `source` on a background thread, `depth` items ahead.
+
+    Items are yielded in their original order. The internal queue is
+    bounded so the producer blocks once it is `depth` items ahead of
+    the consumer. An exception raised by the source is re-raised to
+    the consumer when it reaches that point in the stream.
+
+    `close()` stops the producer early and waits for it to exit;
+    always call it (or use as a context manager) if iteration may be
+    abandoned.
+    """
+
+    # max seconds `close()` waits for an in-progress item to finish
+    JOIN_TIMEOUT = 30
+
+    def __init__(self, source, depth=2):
+        assert depth > 0, "prefetch depth must be positive"
+        self._source = source
+        self._depth = depth
+        self._queue = Queue(maxsize=depth)
+        self._stopped = threading.Event()
+        self._done = False
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def _produce(self):
+        try:
+            for item in self._source:
+                if not self._put((item, None)):
+                    return
+            self._put((_DONE, None))
+        except Exception as e: # pylint: disable=broad-except
+            self._put((_DONE, e))
+
+    def _put(self, entry):
+        """Enqueue an entry. Returns False if the consumer has closed,
+        in which case no further items should be produced."""
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(entry, timeout=0.1)
+                return not self._stopped.is_set()
+            except Full:
+                continue
+        return False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._done:
+            raise StopIteration
+        item, error = self._queue.get()
+        if item is _DONE:
+            self._done = True
+            if error:
+                raise error
+            raise StopIteration
+        return item
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, value, traceback):
+        self.close()
+
+    def depth(self):
+        """Max number of items buffered ahead of the consumer."""
+        return self._depth
+
+    def size(self):
+        """Number of items currently buffered."""
+        return self._queue.qsize()
+
+    def close(self):
+        """Stop the producer thread and drop any buffered items.
+
+        Waits up to `JOIN_TIMEOUT` for an item being produced (e.g. an
+        RPC in flight) to complete, so no work outlives the call."""
+        self._stopped.set()
+        self._done = True
+        while True:
+            try:
+                self._queue.get_nowait()
+            except Empty:
+                break
+        self._thread.join(self.JOIN_TIMEOUT)
+        if self._thread.is_alive():
+            log.warning("prefetch thread still busy after %ds",
+                        self.JOIN_TIMEOUT)
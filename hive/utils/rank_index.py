@@ -0,0 +1,155 @@
+"""Order-statistics index of ids ranked by (float) weight."""
+
+import struct
+from array import array
+from bisect import bisect_left
+
+def _bits(weight):
+    """Order-preserving uint32 of a non-negative weight, as float32."""
+    return struct.unpack('<I', struct.pack('<f', max(float(weight), 0.0)))[0]
+
+class RankIndex:
+    """Ranks ids by weight (descending), with O(log n) updates.
+
+    Each id is a 64-bit key of (float32 weight bits, id), kept sorted
+    in a list of `array` blocks of up to `2 * LOAD` keys. Block sizes
+    are summed by a Fenwick tree, so an id's rank is found by bisecting
+    to its block, then within it. This takes ~12 bytes per id.
+
+    Weights are compared at float32 precision, the same as a `REAL`
+    column; equal weights are ranked by descending id.
+    """
+
+    LOAD = 1000
+
+    def __init__(self):
+        self._blocks = []
+        self._maxes = []
+        self._tree = []
+        self._bits = array('I') # bits+1 by id; 0 if absent
+        self._count = 0
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from `(id, weight)` rows, ideally ordered by weight, id."""
+        obj = cls()
+        keys = array('Q')
+        ordered = True
+        for _id, weight in rows:
+            key = obj._track(_id, _bits(weight))
+            if keys and key < keys[-1]:
+                ordered = False
+            keys.append(key)
+        if not ordered:
+            keys = array('Q', sorted(keys))
+        obj._blocks = [keys[pos:pos + cls.LOAD]
+                       for pos in range(0, len(keys), cls.LOAD)]
+        obj._count = len(keys)
+        obj._rebuild()
+        return obj
+
+    def _track(self, _id, bits):
+        """Record an id's weight bits; return its key."""
+        if _id >= len(self._bits):
+            grow = max(_id + 1 - len(self._bits), len(self._bits) // 8)
+            self._bits.frombytes(bytes(4 * grow))
+        assert not self._bits[_id], "duplicate id %d" % _id
+        self._bits[_id] = bits + 1
+        return bits << 32 | _id
+
+    def _rebuild(self):
+        """Recompute block maxes and the block size tree."""
+        self._maxes = [block[-1] for block in self._blocks]
+        tree = [len(block) for block in self._blocks]
+        for idx, size in enumerate(tree):
+            parent = idx | (idx + 1)
+            if parent < len(tree):
+                tree[parent] += size
+        self._tree = tree
+
+    def _tree_add(self, idx, delta):
+        tree = self._tree
+        while idx < len(tree):
+            tree[idx] += delta
+            idx |= idx + 1
+
+    def _tree_sum(self, idx):
+        """Number of keys in blocks before `idx`."""
+        total = 0
+        while idx > 0:
+            total += self._tree[idx - 1]
+            idx &= idx - 1
+        return total
+
+    def _key(self, _id):
+        if _id is None or _id >= len(self._bits) or not self._bits[_id]:
+            return None
+        return (self._bits[_id] - 1) << 32 | _id
+
+    def _locate(self, key):
+        """Get (block index, offset) of `key`, which must be present."""
+        blk = bisect_left(self._maxes, key)
+        return blk, bisect_left(self._blocks[blk], key)
+
+    def set(self, _id, weight):
+        """Add an id, or update its weight."""
+        key = self._key(_id)
+        if key is not None:
+            if key >> 32 == _bits(weight):
+                return
+            self.remove(_id)
+        key = self._track(_id, _bits(weight))
+        self._count += 1
+
+        if not self._blocks:
+            self._blocks.append(array('Q', [key]))
+            self._rebuild()
+            return
+
+        blk = min(bisect_left(self._maxes, key), len(self._blocks) - 1)
+        block = self._blocks[blk]
+        block.insert(bisect_left(block, key), key)
+        self._maxes[blk] = block[-1]
+        if len(block) > 2 * self.LOAD:
+            self._blocks[blk:blk + 1] = [block[:self.LOAD], block[self.LOAD:]]
+            self._rebuild()
+        else:
+            self._tree_add(blk, 1)
+
+    def remove(self, _id):
+        """Remove an id. Returns True if it was present."""
+        key = self._key(_id)
+        if key is None:
+            return False
+        self._bits[_id] = 0
+        self._count -= 1
+
+        blk, idx = self._locate(key)
+        block = self._blocks[blk]
+        assert block[idx] == key, "index out of sync at id %d" % _id
+        del block[idx]
+        if not block:
+            del self._blocks[blk]
+            self._rebuild()
+        else:
+            self._maxes[blk] = block[-1]
+            self._tree_add(blk, -1)
+        return True
+
+    def rank(self, _id):
+        """Get the 1-based rank of an id (heaviest first), or None."""
+        key = self._key(_id)
+        if key is None:
+            return None
+        blk, idx = self._locate(key)
+        return self._count - (self._tree_sum(blk) + idx)
+
+    def __contains__(self, _id):
+        return self._key(_id) is not None
+
+    def __len__(self):
+        return self._count
+
+    def nbytes(self):
+        """Approximate memory used by the index, in bytes."""
+        return 8 * self._count + 4 * len(self._bits) + 100 * len(self._blocks)
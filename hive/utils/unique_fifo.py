@@ -74,5 +74,8 @@ class UniqueFIFO:
 
         return ret
 
+    def __contains__(self, item):
+        return item in self._set
+
     def __len__(self):
         return len(self._queue)
@@ -0,0 +1,102 @@
+#pylint: disable=missing-docstring
+import pytest
+import ujson as json
+from hive.indexer import checkpoints
+from hive.indexer.checkpoints import (
+    CheckpointReader,
+    CheckpointWriter,
+    dump_checkpoints,
+    list_checkpoints,
+    pack_checkpoint,
+    trim_block,
+)
+
+def _block(num):
+    return {'block_id': '%08x' % num + 'f' * 32,
+            'previous': '%08x' % (num - 1) + 'f' * 32,
+            'timestamp': '2016-03-24T16:05:00',
+            'witness': 'initminer',
+            'transactions': [{'ref_block_num': 1,
+                              'operations': [{'type': 'vote_operation',
+                                              'value': {'voter': 'a'}}]}]}
+
+def _write_lst(path, first, last):
+    with open(str(path), 'w', encoding='utf8') as f:
+        for num in range(first, last + 1):
+            f.write(json.dumps(_block(num)) + "\n")
+
+def _nums(chunks):
+    return [int(b['block_id'][:8], base=16) for chunk in chunks for b in chunk]
+
+def test_list_checkpoints(tmpdir):
+    _write_lst(tmpdir.join('20.json.lst'), 11, 20)
+    _write_lst(tmpdir.join('10.json.lst'), 1, 10)
+    assert [num for num, _ in list_checkpoints(str(tmpdir))] == [10, 20]
+
+def test_trim_block():
+    trimmed = trim_block(_block(5))
+    assert 'witness' not in trimmed
+    assert trimmed['transactions'] == [{'operations': [
+        {'type': 'vote_operation', 'value': {'voter': 'a'}}]}]
+
+def test_read_inline(tmpdir):
+    path = tmpdir.join('25.json.lst')
+    _write_lst(path, 1, 25)
+    with CheckpointReader(chunk_size=10) as reader:
+        chunks = list(reader.read(str(path), skip=3))
+    assert [len(chunk) for chunk in chunks] == [10, 10, 2]
+    assert _nums(chunks) == list(range(4, 26))
+
+def test_read_workers(tmpdir):
+    path = tmpdir.join('50.json.lst')
+    _write_lst(path, 1, 50)
+    with CheckpointReader(workers=2, chunk_size=7) as reader:
+        chunks = list(reader.read(str(path), skip=1))
+    assert _nums(chunks) == list(range(2, 51))
+    assert 'witness' not in chunks[0][0]
+
+def test_pack_and_seek(tmpdir):
+    src = tmpdir.join('30.json.lst')
+    _write_lst(src, 1, 30)
+    out = pack_checkpoint(str(src), frame_size=4)
+    assert out.endswith('30.json.z')
+    assert [path for _, path in list_checkpoints(str(tmpdir))] == [out]
+
+    with CheckpointReader(chunk_size=8) as reader:
+        assert _nums(reader.read(out)) == list(range(1, 31))
+        chunks = list(reader.read(out, skip=9))
+    assert [len(chunk) for chunk in chunks] == [8, 8, 5]
+    assert _nums(chunks) == list(range(10, 31))
+    assert chunks[0][0] == trim_block(_block(10))
+
+    with CheckpointReader(workers=2, chunk_size=8) as reader:
+        assert _nums(reader.read(out, skip=29)) == [30]
+
+def test_writer_abort(tmpdir):
+    path = str(tmpdir.join('5.json.z'))
+    with pytest.raises(AssertionError):
+        with CheckpointWriter(path, 1) as writer:
+            writer.append(_block(1))
+            writer.append(_block(3))
+    assert not tmpdir.listdir()
+
+class _FakeSteem:
+    #pylint: disable=no-self-use,too-few-public-methods
+    def get_blocks_range(self, lbound, ubound):
+        return [_block(num) for num in range(lbound, ubound)]
+
+def test_dump_checkpoints(tmpdir, monkeypatch):
+    path = str(tmpdir)
+    steem = _FakeSteem()
+    monkeypatch.setattr(checkpoints, 'DUMP_CHUNK_SIZE', 4)
+    assert dump_checkpoints(steem, 10, 25, path=path) == 2
+    assert [num for num, _ in list_checkpoints(path)] == [10, 20]
+
+    # resumes after last complete file; partial spans are not written
+    assert dump_checkpoints(steem, 10, 29, path=path) == 0
+    monkeypatch.setattr(checkpoints, 'DUMP_CHUNK_SIZE', 3)
+    assert dump_checkpoints(steem, 10, 30, path=path) == 1
+    files = list_checkpoints(path)
+    assert [num for num, _ in files] == [10, 20, 30]
+    with CheckpointReader(chunk_size=100) as reader:
+        assert _nums(reader.read(files[2][1])) == list(range(21, 31))
@@ -0,0 +1,55 @@
+#pylint: disable=missing-docstring
+from datetime import datetime, timedelta
+from itertools import islice
+
+from hive.steem.block import stream
+from hive.steem.block.schedule import BlockSchedule
+from hive.steem.block.stream import BlockStream
+
+def _block_id(num):
+    return '%08x' % num + 'f' * 32
+
+class StubClient:
+    """Chain of `head` blocks; a new block is produced on every miss."""
+
+    def __init__(self, head):
+        self.head = head
+        self.ranges = []
+        self.misses = 0
+        self.genesis = datetime.utcnow() - timedelta(seconds=3 * head)
+
+    def _block(self, num):
+        date = self.genesis + timedelta(seconds=3 * num)
+        return {'block_id': _block_id(num),
+                'previous': _block_id(num - 1),
+                'timestamp': date.strftime('%Y-%m-%dT%H:%M:%S')}
+
+    def head_block(self):
+        return self.head
+
+    def get_block(self, num, strict=True):
+        if num > self.head:
+            assert not strict
+            self.misses += 1
+            self.head += 1
+            return None
+        return self._block(num)
+
+    def get_blocks_range(self, lbound, ubound):
+        self.ranges.append((lbound, ubound))
+        assert ubound <= self.head + 1, "block %d missing" % (self.head + 1)
+        return [self._block(num) for num in range(lbound, ubound)]
+
+def test_catchup_past_head_estimate(monkeypatch):
+    # estimated head runs well ahead of the chain (e.g. missed slots)
+    monkeypatch.setattr(BlockSchedule, 'wait_for_block',
+                        lambda self, num: num + 50)
+    monkeypatch.setattr(stream, 'sleep', lambda secs: None)
+
+    client = StubClient(head=20)
+    blocks = BlockStream(client, max_gap=0).start(1)
+    nums = [int(block['block_id'][:8], 16) for block in islice(blocks, 22)]
+
+    assert nums == list(range(1, 23))
+    assert client.ranges[0] == (1, 21)
+    assert client.misses >= 1
@@ -18,6 +18,13 @@ def test_get_accounts(client):
     assert len(accounts) == 2
     assert accounts[0]['name'] == 'steemit'
 
+def test_get_accounts_multi():
+    client = SteemClient(url='https://api.steemit.com', max_workers=2)
+    batches = [['steemit'], ['test-safari', 'steemit'], ['test-safari']]
+    results = list(client.get_accounts_multi(batches))
+    assert [len(accounts) for accounts in results] == [1, 2, 1]
+    assert results[1][0]['name'] == 'test-safari'
+
 def test_get_content_batch(client):
     tuples = [('test-safari', 'may-spam'), ('test-safari', 'june-spam')]
     posts = client.get_content_batch(tuples)
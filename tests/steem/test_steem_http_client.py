@@ -0,0 +1,32 @@
+#pylint: disable=missing-docstring
+import time
+from hive.steem.http_client import HttpClient
+
+def _client(monkeypatch):
+    client = HttpClient(nodes=['http://localhost:1'])
+    def _exec(name, args):
+        # later calls finish first, so completion order != request order
+        time.sleep(0.01 * (5 - args % 5))
+        return (name, args)
+    monkeypatch.setattr(client, 'exec', _exec)
+    return client
+
+def test_multi_ordered_order(monkeypatch):
+    client = _client(monkeypatch)
+    results = client.exec_multi_ordered('get_accounts', range(12), 4, 6)
+    assert list(results) == [('get_accounts', i) for i in range(12)]
+
+def test_multi_ordered_bounded(monkeypatch):
+    client = _client(monkeypatch)
+    pulled = []
+    def params():
+        for i in range(20):
+            pulled.append(i)
+            yield i
+
+    results = client.exec_multi_ordered('get_accounts', params(), 2, 3)
+    for count, (_, args) in enumerate(results, 1):
+        assert args == count - 1
+        # never more than `ahead` calls submitted beyond those consumed
+        assert len(pulled) <= min(count + 3, 20)
+    assert len(pulled) == 20
@@ -0,0 +1,26 @@
+#pylint: disable=missing-docstring
+from hive.utils.fingerprints import Fingerprints, fingerprint
+
+def test_fingerprint():
+    assert fingerprint([('a', 1)]) == fingerprint([('a', 1)])
+    assert fingerprint([('a', 1)]) != fingerprint([('a', 2)])
+    assert fingerprint([('a', 1)]) != fingerprint([('b', 1)])
+
+def test_fingerprints_changed():
+    fps = Fingerprints(100)
+    assert fps.changed(1, 'body', [('body', 'x')])
+    assert not fps.changed(1, 'body', [('body', 'x')])
+    assert fps.changed(2, 'body', [('body', 'x')])
+    assert fps.changed(1, 'json', [('body', 'x')])
+    assert fps.changed(1, 'body', [('body', 'y')])
+    assert not fps.changed(1, 'body', [('body', 'y')])
+
+    fps.forget(1, ['body', 'json'])
+    assert fps.changed(1, 'body', [('body', 'y')])
+    fps.clear()
+    assert fps.changed(2, 'body', [('body', 'x')])
+
+def test_fingerprint_64bit():
+    digests = {fingerprint([('body', i)]) for i in range(1000)}
+    assert len(digests) == 1000
+    assert max(digests) >= 2**32
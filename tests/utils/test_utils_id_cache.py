@@ -0,0 +1,48 @@
+#pylint: disable=missing-docstring
+from hive.utils.id_cache import IdCache
+
+def test_id_cache_get_set():
+    cache = IdCache(100)
+    for i in range(1, 51):
+        cache.set('alice/post-%d' % i, i)
+    assert len(cache) == 50
+    assert cache.get('alice/post-7') == 7
+    assert cache.get('alice/missing') is None
+    assert 'alice/post-50' in cache
+    assert 'bob/post-50' not in cache
+
+    cache.set('alice/post-7', 77)
+    assert cache.get('alice/post-7') == 77
+    assert len(cache) == 50
+
+    assert cache.remove('alice/post-7')
+    assert not cache.remove('alice/post-7')
+    assert 'alice/post-7' not in cache and len(cache) == 49
+    assert all(cache.get('alice/post-%d' % i) == i
+               for i in range(1, 51) if i != 7)
+
+def test_id_cache_eviction():
+    cache = IdCache(1000)
+    for i in range(1, 1001):
+        cache.set('a/%d' % i, i)
+    # keep a hot set referenced while inserting new keys
+    for i in range(1001, 1501):
+        for hot in range(1, 11):
+            assert cache.get('a/%d' % hot) == hot
+        cache.set('a/%d' % i, i)
+        assert len(cache) == 1000
+
+    # hot keys survive; everything left maps to its own id
+    assert all('a/%d' % hot in cache for hot in range(1, 11))
+    assert all(cache.get('a/%d' % i) in (i, None) for i in range(1, 1501))
+    assert sum('a/%d' % i in cache for i in range(1, 1501)) == 1000
+
+def test_id_cache_nbytes():
+    cache = IdCache(2000000)
+    assert cache.capacity() == 2000000
+    assert cache.nbytes() < 64 * 1024**2
+
+def test_id_cache_wide():
+    cache = IdCache(10, wide=True)
+    cache.set('a', 2**63 + 5)
+    assert cache.get('a') == 2**63 + 5
@@ -0,0 +1,26 @@
+#pylint: disable=missing-docstring
+from hive.utils.level_queue import LevelQueue
+
+def test_level_queue_add():
+    queue = LevelQueue(3)
+    assert queue.add('a', 2)
+    assert queue.add('b', 1)
+    assert queue.add('c', 2)
+    assert not queue.add('b', 2) # no demotion
+    assert queue.add('c', 0)     # promotion
+    assert queue.depths() == [1, 1, 1]
+    assert queue.level('c') == 0
+    assert len(queue) == 3
+    assert 'a' in queue and 'd' not in queue
+
+def test_level_queue_take():
+    queue = LevelQueue(2)
+    for key in 'abcde':
+        queue.add(key, 1)
+    assert queue.take(1, 2) == ['a', 'b']
+    assert queue.take(0) == []
+    assert queue.remove('d')
+    assert not queue.remove('d')
+    assert queue.take(1) == ['c', 'e']
+    assert not queue
+    assert queue.add('a', 1)
@@ -0,0 +1,35 @@
+#pylint: disable=missing-docstring
+import pytest
+from hive.utils.name_map import NameMap
+
+def test_name_map_from_sorted():
+    rows = [('alice', 3), ('bob', 1), ('bobby', 4), ('carol', 2)]
+    ids = NameMap.from_sorted(rows)
+    assert len(ids) == 4
+    assert ids['bob'] == 1
+    assert ids.get('bobby') == 4
+    assert 'carol' in ids
+    assert 'dave' not in ids
+    assert ids.get('dave') is None
+    with pytest.raises(KeyError):
+        _ = ids['dave']
+
+def test_name_map_unsorted():
+    with pytest.raises(AssertionError):
+        NameMap.from_sorted([('bob', 1), ('alice', 2)])
+
+def test_name_map_append():
+    ids = NameMap.from_sorted([('a%05d' % i, i + 1) for i in range(0, 5000, 2)])
+    for i in range(1, 5000, 2):
+        ids['a%05d' % i] = i + 1
+    ids['x' * 20] = 9999
+    assert len(ids) == 5001
+    assert all(ids['a%05d' % i] == i + 1 for i in range(5000))
+    assert ids['x' * 20] == 9999
+    with pytest.raises(AssertionError):
+        ids['a00001'] = 1
+
+def test_name_map_empty():
+    ids = NameMap()
+    assert not ids
+    assert 'alice' not in ids
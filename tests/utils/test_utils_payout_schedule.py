@@ -0,0 +1,21 @@
+#pylint: disable=missing-docstring
+from hive.utils.payout_schedule import PayoutSchedule
+
+def test_payout_schedule():
+    sched = PayoutSchedule(width=60)
+    sched.add(1, 1000)
+    sched.add(2, 1030)
+    sched.add(3, 1100)
+    sched.add(4, 5000)
+    sched.add(1, 1000) # duplicate
+    assert len(sched) == 5
+
+    assert sched.pop_due(999) == []
+    assert sched.pop_due(1000) == [1]
+    assert sched.pop_due(1000) == []
+    assert sched.pop_due(1100) == [2, 3]
+    assert len(sched) == 1
+
+    sched.add(5, 1200)
+    assert sched.pop_due(10000) == [4, 5]
+    assert not sched
@@ -0,0 +1,47 @@
+#pylint: disable=missing-docstring
+import time
+import pytest
+from hive.utils.prefetch import Prefetch
+
+def test_prefetch_order():
+    items = list(Prefetch(iter(range(100)), depth=3))
+    assert items == list(range(100))
+
+def test_prefetch_empty():
+    assert list(Prefetch(iter([]), depth=1)) == []
+
+def test_prefetch_error():
+    def source():
+        yield 1
+        yield 2
+        raise ValueError('boom')
+
+    queue = Prefetch(source(), depth=2)
+    assert next(queue) == 1
+    assert next(queue) == 2
+    with pytest.raises(ValueError):
+        next(queue)
+    with pytest.raises(StopIteration):
+        next(queue)
+
+def test_prefetch_close():
+    with Prefetch(iter(range(1000)), depth=2) as queue:
+        assert next(queue) == 0
+        assert queue.depth() == 2
+    assert list(queue) == []
+
+def test_prefetch_close_joins():
+    pulled = []
+    def source():
+        for i in range(1000):
+            time.sleep(0.01)
+            pulled.append(i)
+            yield i
+
+    queue = Prefetch(source(), depth=2)
+    assert next(queue) == 0
+    queue.close()
+    count = len(pulled)
+    assert not queue._thread.is_alive() # pylint: disable=protected-access
+    time.sleep(0.05)
+    assert len(pulled) == count <= 5
@@ -0,0 +1,39 @@
+#pylint: disable=missing-docstring
+import random
+from hive.utils.rank_index import RankIndex
+
+def _ranks(weights):
+    order = sorted(weights, key=lambda i: (weights[i], i), reverse=True)
+    return {_id: rank for rank, _id in enumerate(order, 1)}
+
+def test_rank_index_basic():
+    index = RankIndex.from_rows([(1, 5.0), (2, 10.0), (3, 0)])
+    assert [index.rank(i) for i in (1, 2, 3)] == [2, 1, 3]
+    assert index.rank(4) is None
+    index.set(4, 7.5)
+    index.set(3, 20)
+    assert [index.rank(i) for i in (1, 2, 3, 4)] == [4, 2, 1, 3]
+    assert index.remove(2)
+    assert not index.remove(2)
+    assert 2 not in index and len(index) == 3
+    assert index.rank(1) == 3
+
+def test_rank_index_random():
+    RankIndex.LOAD, load = 8, RankIndex.LOAD
+    try:
+        rng = random.Random(42)
+        weights = {i: float(rng.randint(0, 50)) for i in range(1, 300)}
+        index = RankIndex.from_rows(weights.items())
+        for _ in range(2000):
+            _id = rng.randint(1, 400)
+            if rng.random() < 0.1:
+                index.remove(_id)
+                weights.pop(_id, None)
+            else:
+                weights[_id] = float(rng.randint(0, 50))
+                index.set(_id, weights[_id])
+        expected = _ranks(weights)
+        assert len(index) == len(expected)
+        assert all(index.rank(i) == r for i, r in expected.items())
+    finally:
+        RankIndex.LOAD = load
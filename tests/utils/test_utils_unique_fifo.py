@@ -40,3 +40,10 @@ def test_unique_queue():
     assert len(q) == 3
     pop3 = q.shift_portion(1)
     assert pop3 == ['foo', 'bar', 'cat']
+
+def test_unique_queue_contains():
+    q = UniqueFIFO()
+    q.add('tim')
+    assert 'tim' in q and 'bob' not in q
+    q.shift_count(1)
+    assert 'tim' not in q